@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+相册收集器 - 把同一 grouped_id 的消息合并后一起发送
+"""
+
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Telegram 单个相册最多包含10个媒体
+MAX_ALBUM_SIZE = 10
+
+
+class AlbumCollector:
+    """在短时间窗口内收集同一相册的各个部分
+
+    每收到一个部分就重新计时，窗口内没有新部分 (或已满10个) 时相册收集完成。
+    收集期间同一源的其他消息 (由调用方通过 holding 判断后交给 add) 排在相册后面，
+    按收到的顺序依次交给 callback(source_chat_id, messages) 处理，不会抢在相册前面发送。
+    """
+
+    def __init__(self, callback, window=0.5):
+        self.callback = callback
+        self.window = window
+        self.albums = {}   # (源ID, grouped_id) -> [排队项, 定时器]
+        self.backlog = {}  # 源ID -> deque([[消息列表, 是否收集完成], ...])，按收到的顺序
+        self.draining = set()  # 正在交出排队项的源
+        self.tasks = set()
+
+    def holding(self, source_chat_id):
+        """该源是否有还没交出的相册，此时该源的新消息也要交给 add 排在后面"""
+        return source_chat_id in self.backlog
+
+    def pending(self):
+        """收集器中还没交出的消息数"""
+        return sum(len(messages) for backlog in self.backlog.values() for messages, _ in backlog)
+
+    def add(self, source_chat_id, message):
+        """加入一条相册消息，或排在相册后面的普通消息"""
+        backlog = self.backlog.setdefault(source_chat_id, deque())
+        grouped_id = getattr(message, 'grouped_id', None)
+        if not grouped_id:
+            backlog.append([[message], True])
+            self._drain(source_chat_id)
+            return
+        key = (source_chat_id, grouped_id)
+        entry = self.albums.get(key)
+        if entry is None:
+            slot = [[], False]
+            backlog.append(slot)
+            entry = self.albums[key] = [slot, None]
+        entry[0][0].append(message)
+        if entry[1]:
+            entry[1].cancel()
+        if len(entry[0][0]) >= MAX_ALBUM_SIZE:
+            self._flush(key)
+        else:
+            entry[1] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+    def _flush(self, key):
+        """窗口结束，相册收集完成"""
+        entry = self.albums.pop(key, None)
+        if entry is None:
+            return
+        slot, timer = entry
+        if timer:
+            timer.cancel()
+        slot[0].sort(key=lambda m: m.id)
+        slot[1] = True
+        self._drain(key[0])
+
+    def _drain(self, source_chat_id):
+        """开始按顺序交出该源已经收集完成的排队项 (每个源同时只有一个交出任务)"""
+        backlog = self.backlog.get(source_chat_id)
+        if source_chat_id in self.draining or not backlog or not backlog[0][1]:
+            return
+        self.draining.add(source_chat_id)
+        task = asyncio.create_task(self._deliver(source_chat_id, backlog))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _deliver(self, source_chat_id, backlog):
+        """依次交出排在最前面、已经收集完成的项，遇到还在收集的相册时停下"""
+        try:
+            while backlog and backlog[0][1]:
+                try:
+                    await self.callback(source_chat_id, backlog[0][0])
+                except Exception as e:
+                    logger.error(f"提交相册失败: {e}")
+                # 交出后才移除，交出期间到达的新消息仍然排在后面
+                backlog.popleft()
+        finally:
+            self.draining.discard(source_chat_id)
+            if not backlog and self.backlog.get(source_chat_id) is backlog:
+                del self.backlog[source_chat_id]
+
+    async def flush_all(self):
+        """立即提交所有未完成的相册并等待处理结束"""
+        for key in list(self.albums):
+            self._flush(key)
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
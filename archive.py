@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+本地归档 - 把同步过的每条消息的元数据和文本追加写入分段压缩文件，
+并用SQLite附属索引按 (源, 消息ID) 和日期定位，重新处理历史时只需顺序读取本地文件
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+from state_store import open_state_db
+from stream_recorder import describe_message
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PATTERN = re.compile(r'^segment-(\d+)\.jsonl\.gz$')
+
+
+def segment_name(segment):
+    return f"segment-{segment:06d}.jsonl.gz"
+
+
+def read_block(path, offset, length):
+    """读取分段文件中一个压缩块内的所有记录"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = gzip.decompress(f.read(length))
+    return [json.loads(line) for line in data.decode('utf-8').splitlines() if line]
+
+
+class MessageArchive:
+    """追加写入的消息归档
+
+    - 分段文件: directory/segment-NNNNNN.jsonl.gz，每次提交写入一个独立的gzip块，
+      超过 segment_size 后开始新的分段；已写入的内容不会被修改
+    - 附属索引: directory/index.db，(源ID, 消息ID) 和日期 -> (分段, 块偏移, 块长度)，同一消息重复归档 (编辑) 时指向最新版本；
+      另记录每个分段已登记的长度，打开时据此检查上次异常退出时写了一半的块
+    - 源消息删除时追加 {"source", "id", "deleted": true} 记录，索引指向它，按日期读取时不再返回这条消息
+    写入先进入缓冲区，按批量或时间间隔提交 (run_flush 在没有新消息时也定期提交)；
+    每隔 fsync_interval 秒把分段文件同步到磁盘。
+    """
+
+    def __init__(self, directory='archive', segment_size=64 * 1024 * 1024, batch_size=500,
+                 flush_interval=5, fsync_interval=30):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+        self.conn = open_state_db(os.path.join(directory, 'index.db'))
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS archive_index ('
+            ' source_chat_id INTEGER NOT NULL,'
+            ' message_id INTEGER NOT NULL,'
+            ' date REAL,'
+            ' segment INTEGER NOT NULL,'
+            ' offset INTEGER NOT NULL,'
+            ' length INTEGER NOT NULL,'
+            ' PRIMARY KEY (source_chat_id, message_id)'
+            ') WITHOUT ROWID'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS archive_by_date ON archive_index (date)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS archive_segments ('
+            ' segment INTEGER PRIMARY KEY,'
+            ' size INTEGER NOT NULL'
+            ')'
+        )
+        self.conn.commit()
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 1
+        self.recover()
+        self.file = open(self.segment_path(self.segment), 'ab')
+        self.pending = []  # [(源ID, 消息ID, 日期, 记录JSON), ...]
+        self.last_flush = time.monotonic()
+        self.last_fsync = time.monotonic()
+        self.unsynced = False
+
+    def segments(self):
+        """已有的分段编号，从旧到新"""
+        return sorted(
+            int(match.group(1)) for match in map(SEGMENT_PATTERN.match, os.listdir(self.directory)) if match
+        )
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, segment_name(segment))
+
+    def recover(self):
+        """检查当前分段在已登记长度之后的数据: 完整的压缩块补登索引，写了一半的块截掉"""
+        path = self.segment_path(self.segment)
+        if not os.path.exists(path):
+            return
+        row = self.conn.execute('SELECT size FROM archive_segments WHERE segment = ?', (self.segment,)).fetchone()
+        if row is None:
+            # 没有记录分段长度的旧归档，按索引中最后一个块的位置计算
+            row = self.conn.execute(
+                'SELECT MAX(offset + length) FROM archive_index WHERE segment = ?', (self.segment,)
+            ).fetchone()
+        end = row[0] or 0
+        size = os.path.getsize(path)
+        if size <= end:
+            return
+        with open(path, 'rb') as f:
+            f.seek(end)
+            data = f.read()
+        offset = end
+        rows = []
+        while data:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            try:
+                text = decompressor.decompress(data)
+            except zlib.error:
+                break
+            if not decompressor.eof:
+                break
+            length = len(data) - len(decompressor.unused_data)
+            for line in text.decode('utf-8', 'replace').splitlines():
+                try:
+                    record = json.loads(line)
+                    rows.append((record['source'], record['id'], record.get('date'), self.segment, offset, length))
+                except (ValueError, KeyError, TypeError):
+                    continue
+            offset += length
+            data = decompressor.unused_data
+        if offset < size:
+            logger.warning(f"归档分段 {path} 末尾有 {size - offset} 字节不完整的数据 (上次可能异常退出)，已截掉")
+            os.truncate(path, offset)
+        with self.conn:
+            if rows:
+                logger.info(f"归档分段 {path} 中有 {len(rows)} 条记录没有登记索引，已补上")
+                self.conn.executemany('INSERT OR REPLACE INTO archive_index VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.conn.execute('INSERT OR REPLACE INTO archive_segments VALUES (?, ?)', (self.segment, offset))
+
+    def append(self, source_chat_id, message, source_name=None, targets=None, edited=False, info=None):
+        """归档一条消息，targets 为 目标频道 -> 目标消息ID，info 为已有的分类结果"""
+        try:
+            record = {'source': source_chat_id}
+            if source_name:
+                record['source_name'] = source_name
+            record.update(describe_message(message, info))
+            if targets:
+                record['targets'] = {str(target): target_msg_id for target, target_msg_id in targets.items()}
+            if edited:
+                record['edited'] = True
+            record['archived_at'] = round(time.time(), 3)
+        except Exception as e:
+            logger.warning(f"归档消息失败: {e}")
+            return
+        self.put(source_chat_id, message.id, record.get('date'), record)
+
+    def delete(self, source_chat_id, message_ids):
+        """源消息被删除: 为归档过的消息追加删除记录"""
+        self.flush()
+        archived = set()
+        for start in range(0, len(message_ids), 500):
+            chunk = list(message_ids[start:start + 500])
+            archived.update(message_id for message_id, in self.conn.execute(
+                'SELECT message_id FROM archive_index WHERE source_chat_id = ? AND message_id IN (%s)'
+                % ','.join('?' * len(chunk)),
+                [source_chat_id] + chunk
+            ))
+        now = round(time.time(), 3)
+        for message_id in sorted(archived):
+            self.put(source_chat_id, message_id, None,
+                     {'source': source_chat_id, 'id': message_id, 'deleted': True, 'archived_at': now})
+
+    def put(self, source_chat_id, message_id, date, record):
+        self.pending.append((
+            source_chat_id, message_id, date,
+            json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        ))
+        if (len(self.pending) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """把缓冲的记录作为一个压缩块写入当前分段，再更新索引"""
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        offset = None
+        try:
+            if self.file.closed:
+                self.file = open(self.segment_path(self.segment), 'ab')
+            if self.file.tell() >= self.segment_size:
+                self.rotate()
+            offset = self.file.tell()
+            data = '\n'.join(line for _, _, _, line in self.pending) + '\n'
+            block = gzip.compress(data.encode('utf-8'))
+            self.file.write(block)
+            self.file.flush()
+            self.unsynced = True
+            if time.monotonic() - self.last_fsync >= self.fsync_interval:
+                self.sync()
+        except OSError as e:
+            logger.error(f"写入归档失败: {e}")
+            if offset is not None:
+                self.discard_tail(offset)
+            return
+        rows = [(source_chat_id, message_id, date, self.segment, offset, len(block))
+                for source_chat_id, message_id, date, _ in self.pending]
+        self.pending = []
+        try:
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO archive_index VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO archive_segments VALUES (?, ?)', (self.segment, offset + len(block))
+                )
+        except sqlite3.Error as e:
+            logger.error(f"更新归档索引失败: {e}")
+
+    def discard_tail(self, offset):
+        """写入失败后截掉当前分段在 offset 之后写了一半的块，缓冲的记录留到下次重新写入"""
+        # 缓冲区里还留着没写完的数据，先关闭文件再按路径截断
+        try:
+            self.file.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(self.segment_path(self.segment), offset)
+            self.file = open(self.segment_path(self.segment), 'ab')
+        except OSError as e:
+            logger.error(f"截断归档失败: {e}")
+
+    async def run_flush(self):
+        """定期提交缓冲的记录并按 fsync_interval 同步，没有新消息时记录也不会一直留在内存中"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+            if self.unsynced and time.monotonic() - self.last_fsync >= self.fsync_interval:
+                try:
+                    self.sync()
+                except OSError as e:
+                    logger.error(f"同步归档失败: {e}")
+
+    def sync(self):
+        """把当前分段同步到磁盘"""
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = False
+        self.last_fsync = time.monotonic()
+
+    def rotate(self):
+        """当前分段已满，开始新的分段"""
+        self.sync()
+        self.file.close()
+        self.segment += 1
+        self.file = open(self.segment_path(self.segment), 'ab')
+
+    def get(self, source_chat_id, message_id):
+        """按索引读取一条消息的最新归档记录 (已删除的消息返回删除记录)，没有时返回None"""
+        self.flush()
+        row = self.conn.execute(
+            'SELECT segment, offset, length FROM archive_index WHERE source_chat_id = ? AND message_id = ?',
+            (source_chat_id, message_id)
+        ).fetchone()
+        if row is None:
+            return None
+        records = read_block(self.segment_path(row[0]), row[1], row[2])
+        return next((record for record in reversed(records)
+                     if record['source'] == source_chat_id and record['id'] == message_id), None)
+
+    def scan(self, since=None, until=None, source_chat_id=None):
+        """按写入顺序读取归档记录
+
+        since / until 为消息时间的时间戳范围，指定时通过日期索引只读取包含这些消息的压缩块；
+        全量读取时同一消息的每个版本和删除记录都会返回；按日期读取时只返回每条消息的最新版本，
+        已删除的消息不会返回。
+        """
+        self.flush()
+        if since is None and until is None:
+            for segment in self.segments():
+                with gzip.open(self.segment_path(segment), 'rt', encoding='utf-8') as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if source_chat_id is None or record['source'] == source_chat_id:
+                            yield record
+            return
+        sql = ('SELECT segment, offset, length, source_chat_id, message_id FROM archive_index'
+               ' WHERE date >= ? AND date < ?')
+        params = [since if since is not None else float('-inf'), until if until is not None else float('inf')]
+        if source_chat_id is not None:
+            sql += ' AND source_chat_id = ?'
+            params.append(source_chat_id)
+        blocks = {}  # (分段, 块偏移, 块长度) -> 索引指向该块的消息
+        for segment, offset, length, source, message_id in self.conn.execute(sql, params):
+            blocks.setdefault((segment, offset, length), set()).add((source, message_id))
+        for (segment, offset, length), keys in sorted(blocks.items()):
+            records = read_block(self.segment_path(segment), offset, length)
+            latest = {}
+            for record in records:
+                key = (record['source'], record['id'])
+                if key in keys:
+                    latest[key] = record
+            for record in records:
+                if latest.get((record['source'], record['id'])) is record:
+                    yield record
+
+    def close(self):
+        """提交剩余记录，同步到磁盘并关闭"""
+        self.flush()
+        try:
+            self.sync()
+        except OSError as e:
+            logger.error(f"同步归档失败: {e}")
+        self.file.close()
+        self.conn.close()
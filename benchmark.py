@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+离线基准测试 - 用模拟客户端在合成负载上运行历史同步和实时消息处理流程，
+报告吞吐量、峰值内存和发送延迟分位数，不需要网络，可以在CI中运行
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_client import FakeTelegramClient, RecordedWorkload, Workload, message_from_record
+from stream_recorder import load_recording
+from telegram_sync import TelegramSyncer
+
+TARGET_CHANNEL = -1009000000001
+FIRST_SOURCE = -1001000000001
+
+# 场景: mode 为 history (sync_history 单个源)、all_history (sync_all_history) 或 live (实时处理器)，
+# count 为所有源的消息总数 (会乘以 --scale)
+SCENARIOS = {
+    'history_text': {
+        'mode': 'history', 'sources': 1, 'count': 100000,
+    },
+    'history_all': {
+        'mode': 'all_history', 'sources': 4, 'count': 100000,
+    },
+    'history_forward': {
+        'mode': 'history', 'sources': 1, 'count': 100000,
+        'config': {'forward_mode': 'forward'},
+    },
+    'history_media': {
+        'mode': 'history', 'sources': 1, 'count': 5000,
+        'workload': {'media_ratio': 0.8, 'album_ratio': 0.5, 'repeat_media_ratio': 0.3, 'media_size': 4 * 1024 * 1024},
+        'client': {'reference_failure_rate': 0.2, 'bandwidth': 200 * 1024 * 1024},
+    },
+    'history_flood': {
+        'mode': 'history', 'sources': 1, 'count': 5000,
+        'client': {'flood_rate': 0.01, 'flood_seconds': 0.05},
+    },
+    'live_text': {
+        'mode': 'live', 'sources': 4, 'count': 20000,
+    },
+    'live_media': {
+        'mode': 'live', 'sources': 2, 'count': 2000,
+        'workload': {'media_ratio': 0.8, 'album_ratio': 0.5, 'repeat_media_ratio': 0.3, 'media_size': 4 * 1024 * 1024},
+        'client': {'reference_failure_rate': 0.2, 'bandwidth': 200 * 1024 * 1024},
+    },
+}
+
+
+def merge_config(base, override):
+    """递归合并配置字典"""
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merge_config(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+def harness_config(work_dir):
+    """基准测试固定使用的配置: 不限速、不输出汇总日志、不录制，状态和媒体暂存目录放在临时目录中"""
+    return {
+        'history_sync': {'enabled': True, 'limit': None, 'days_back': None},
+        'rate_limit': {'rate': 1e6, 'burst': 1e6, 'max_rate': 1e6},
+        'state': {'db_path': os.path.join(work_dir, 'sync_state.db')},
+        'media_cache': {'spool_dir': os.path.join(work_dir, 'media_spool')},
+        'metrics': {'summary_interval': 0, 'http_port': None},
+        'catch_up': {'check_interval': 3600},
+        'record': {'enabled': False},
+    }
+
+
+def build_config(scenario, work_dir, override):
+    """生成合成负载场景使用的配置"""
+    config = {
+        'api_id': 0,
+        'api_hash': '',
+        'phone': '',
+        'target_channel': str(TARGET_CHANNEL),
+        'source_chats': {str(FIRST_SOURCE - i): f"源{i + 1}" for i in range(scenario['sources'])},
+        'add_source_info': True,
+        'filters': {},
+    }
+    merge_config(config, harness_config(work_dir))
+    merge_config(config, scenario.get('config', {}))
+    return merge_config(config, override)
+
+
+def percentiles(samples):
+    """精确的延迟分位数 (毫秒)"""
+    if not samples:
+        return None
+    samples = sorted(samples)
+
+    def rank(fraction):
+        return round(samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000, 3)
+
+    return {'p50': rank(0.5), 'p90': rank(0.9), 'p99': rank(0.99), 'max': round(samples[-1] * 1000, 3)}
+
+
+def peak_rss_mb():
+    """进程的峰值常驻内存 (MB)，Linux上 ru_maxrss 单位为KB，macOS上为字节"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Harness:
+    """一次测试运行: 临时配置 + 模拟客户端 + 同步器，并收集原始延迟样本
+
+    指标中的直方图只有分桶结果，这里额外记录每个样本以计算精确的分位数。
+    """
+
+    def __init__(self, config_file, client):
+        self.client = client
+        self.syncer = TelegramSyncer(config_file)
+        if not self.syncer.config:
+            raise RuntimeError("无法加载基准测试配置")
+        self.syncer.attach_client(client)
+        self.samples = {'send_latency_seconds': [], 'forward_latency_seconds': []}
+        self.peak_queue_depth = 0
+        observe = self.syncer.metrics.observe
+
+        def record(metric, value, **labels):
+            if metric in self.samples:
+                self.samples[metric].append(value)
+            observe(metric, value, **labels)
+
+        self.syncer.metrics.observe = record
+
+    async def watch_queue(self):
+        """采样发送队列的最大深度"""
+        while True:
+            self.peak_queue_depth = max(self.peak_queue_depth, self.syncer.send_queue.depth())
+            await asyncio.sleep(0.05)
+
+    async def run_history(self, source_chat_id=None):
+        """运行历史同步 (指定源时用 sync_history，否则用 sync_all_history)，返回耗时"""
+        started = time.perf_counter()
+        try:
+            if source_chat_id is None:
+                await self.syncer.sync_all_history()
+            else:
+                await self.syncer.sync_history(source_chat_id)
+            return time.perf_counter() - started
+        finally:
+            self.syncer.close()
+
+    async def run_live(self, emit, sync_history_first=False):
+        """启动完整的监听流程，就绪后调用 emit() 派发消息，等待发送队列清空
+
+        返回 (就绪前的耗时, 派发开始到发送队列清空的耗时)；
+        sync_history_first 时就绪前的耗时就是历史同步的耗时。
+        """
+        started = time.perf_counter()
+        task = asyncio.create_task(self.syncer.start_sync(sync_history_first=sync_history_first))
+        while not self.client.handlers or self.syncer.held_messages:
+            if task.done():
+                task.result()
+                raise RuntimeError("实时监听流程提前结束")
+            await asyncio.sleep(0.01)
+
+        ready = time.perf_counter()
+        watcher = asyncio.create_task(self.watch_queue())
+        try:
+            await emit()
+            await self.syncer.album_collector.flush_all()
+            await self.syncer.send_queue.join()
+        finally:
+            watcher.cancel()
+        elapsed = time.perf_counter() - ready
+
+        await self.client.disconnect()
+        await task
+        return ready - started, elapsed
+
+    def result(self, name, mode, total, elapsed, **extra):
+        metrics = self.syncer.metrics
+        result = {
+            'scenario': name,
+            'mode': mode,
+            'messages': total,
+            'seconds': round(elapsed, 3),
+            'messages_per_second': round(total / elapsed, 1) if elapsed else None,
+            'forwarded': metrics.total('messages_forwarded'),
+            'filtered': metrics.total('messages_filtered'),
+            'duplicates': metrics.total('messages_duplicate'),
+            'failed': metrics.total('messages_failed'),
+            'send_latency_ms': percentiles(self.samples['send_latency_seconds']),
+            'forward_latency_ms': percentiles(self.samples['forward_latency_seconds']),
+            'peak_rss_mb': peak_rss_mb(),
+            'client': self.client.stats(),
+        }
+        if mode != 'history':
+            result['peak_queue_depth'] = self.peak_queue_depth
+        result.update(extra)
+        return result
+
+
+def client_options(args, options=None):
+    """场景的模拟客户端参数，未指定的延迟使用命令行参数"""
+    options = dict(options or {})
+    options.setdefault('latency', args.latency)
+    options.setdefault('jitter', args.jitter)
+    return options
+
+
+def write_config(work_dir, config):
+    config_file = os.path.join(work_dir, 'config.json')
+    with open(config_file, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False)
+    return config_file
+
+
+async def run_scenario(name, args):
+    """在当前进程中运行一个合成负载场景，返回结果字典"""
+    scenario = SCENARIOS[name]
+    per_source = max(1, int(scenario['count'] * args.scale) // scenario['sources'])
+    sources = [FIRST_SOURCE - i for i in range(scenario['sources'])]
+
+    with tempfile.TemporaryDirectory(prefix='tg_bench_') as work_dir:
+        config_file = write_config(work_dir, build_config(scenario, work_dir, args.config_override))
+        workloads = {
+            source_chat_id: Workload(per_source, seed=index + 1, **scenario.get('workload', {}))
+            for index, source_chat_id in enumerate(sources)
+        }
+        client = FakeTelegramClient(workloads, seed=args.seed, **client_options(args, scenario.get('client')))
+        harness = Harness(config_file, client)
+
+        if scenario['mode'] == 'live':
+            async def emit():
+                # 按源轮流派发，消息时间为派发时间，端到端延迟从派发算起
+                for message_id in range(1, per_source + 1):
+                    for source_chat_id in sources:
+                        await client.emit(source_chat_id, client.live_message(source_chat_id, message_id))
+
+            _, elapsed = await harness.run_live(emit)
+        elif scenario['mode'] == 'all_history':
+            elapsed = await harness.run_history()
+        else:
+            elapsed = await harness.run_history(sources[0])
+        return harness.result(name, scenario['mode'], per_source * len(sources), elapsed)
+
+
+def build_replay_config(records, work_dir, args):
+    """重放使用的配置: 以 --config 指定的配置为基础 (过滤、去重、路由、队列等)，补充录制中出现的源"""
+    config = {
+        'api_id': 0,
+        'api_hash': '',
+        'phone': '',
+        'target_channel': str(TARGET_CHANNEL),
+        'source_chats': {},
+    }
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            merge_config(config, json.load(f))
+    rate_limit = config.get('rate_limit')
+    merge_config(config, harness_config(work_dir))
+    if args.keep_rate_limit:
+        config['rate_limit'] = rate_limit or {}
+    config['history_sync']['enabled'] = any(record['src'] == 'history' for record in records)
+    source_chats = {str(chat_id).strip(): name for chat_id, name in config['source_chats'].items()}
+    for record in records:
+        source_chats.setdefault(str(record['chat']), f"源 {record['chat']}")
+    config['source_chats'] = source_chats
+    return merge_config(config, args.config_override)
+
+
+async def run_replay(args):
+    """把录制的消息流经完整的同步流程重放
+
+    历史记录作为 iter_messages 的结果先经历史同步处理；实时和补齐记录按录制时的间隔除以 --speed 派发
+    (0 表示不等待)。消息保留原始时间，过滤和去重的结果与录制时一致；端到端延迟从派发算起。
+    """
+    records = load_recording(args.replay)
+    if not records:
+        raise RuntimeError(f"录制文件 {args.replay} 中没有记录")
+    history = {}
+    live = []
+    for record in records:
+        if record['src'] == 'history':
+            history.setdefault(record['chat'], []).append(record)
+        else:
+            live.append(record)
+
+    with tempfile.TemporaryDirectory(prefix='tg_replay_') as work_dir:
+        config_file = write_config(work_dir, build_replay_config(records, work_dir, args))
+        workloads = {chat_id: RecordedWorkload(chat_id, chat_records) for chat_id, chat_records in history.items()}
+        client = FakeTelegramClient(workloads, seed=args.seed, **client_options(args))
+        harness = Harness(config_file, client)
+        syncer = harness.syncer
+
+        # 实时消息保留原始时间，端到端延迟改为从派发到发送完成
+        emitted = {}
+        forward_latency = harness.samples['forward_latency_seconds']
+        harness.samples['forward_latency_seconds'] = []
+        deliver_live = syncer.send_queue.handler
+
+        async def timed_deliver(source_chat_id, item):
+            await deliver_live(source_chat_id, item)
+            emitted_at = emitted.pop((source_chat_id, item[0][0].id), None)
+            if emitted_at is not None:
+                forward_latency.append(time.perf_counter() - emitted_at)
+
+        syncer.send_queue.handler = timed_deliver
+
+        async def emit():
+            started = time.perf_counter()
+            first = live[0]['t'] if live else 0
+            for record in live:
+                if args.speed:
+                    delay = (record['t'] - first) / args.speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                chat_id = record['chat']
+                message = message_from_record(chat_id, record)
+                emitted[(chat_id, message.id)] = time.perf_counter()
+                if record['src'] == 'catch_up':
+                    await syncer.accept_live(chat_id, message)
+                else:
+                    await client.emit(chat_id, message)
+
+        history_seconds, live_seconds = await harness.run_live(emit, sync_history_first=bool(history))
+        harness.samples['forward_latency_seconds'] = forward_latency
+        history_count = sum(len(chat_records) for chat_records in history.values())
+        return harness.result(
+            'replay', 'replay', len(live), live_seconds,
+            speed=args.speed or 'max',
+            history_messages=history_count,
+            history_seconds=round(history_seconds, 3),
+        )
+
+
+def run_isolated(name, args):
+    """在子进程中运行场景，使峰值内存只反映该场景"""
+    command = [
+        sys.executable, os.path.abspath(__file__), '--child', name,
+        '--scale', str(args.scale), '--latency', str(args.latency), '--jitter', str(args.jitter),
+        '--seed', str(args.seed), '--config-override', json.dumps(args.config_override),
+        '--log-level', args.log_level,
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, check=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def print_table(results):
+    print(f"{'场景':<18}{'消息数':>9}{'耗时(s)':>10}{'条/秒':>11}{'过滤':>8}{'重复':>8}{'峰值内存(MB)':>14}"
+          f"{'发送p50(ms)':>13}{'发送p99(ms)':>13}{'端到端p99(ms)':>15}")
+    for result in results:
+        send = result['send_latency_ms'] or {}
+        forward = result['forward_latency_ms'] or {}
+        print(f"{result['scenario']:<20}{result['messages']:>9}{result['seconds']:>10}"
+              f"{result['messages_per_second']:>12}{result['filtered']:>10}{result['duplicates']:>10}"
+              f"{result['peak_rss_mb']:>14}"
+              f"{send.get('p50', '-'):>13}{send.get('p99', '-'):>13}{forward.get('p99', '-'):>15}")
+
+
+def compare_baseline(results, baseline_file, max_regression):
+    """与基线结果比较吞吐量，返回下降超过 max_regression 的场景"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = {result['scenario']: result for result in json.load(f)}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['scenario'])
+        if not previous or not previous.get('messages_per_second'):
+            continue
+        change = result['messages_per_second'] / previous['messages_per_second'] - 1
+        if change < -max_regression:
+            regressions.append((result['scenario'], previous['messages_per_second'], result['messages_per_second']))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Telegram同步工具离线基准测试")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"逗号分隔的场景列表，可选: {', '.join(SCENARIOS)}")
+    parser.add_argument('--scale', type=float, default=1.0, help="消息数量的缩放比例，CI中可用0.05等较小的值")
+    parser.add_argument('--latency', type=float, default=0.0, help="模拟的每个请求的延迟 (秒)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="模拟的请求延迟随机抖动 (秒)")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    parser.add_argument('--config-override', type=json.loads, default={},
+                        help='合并到基准测试配置中的JSON，例如 \'{"dedup": {"enabled": true}}\'')
+    parser.add_argument('--replay', help="重放录制的消息流文件 (见配置中的 record)，代替合成负载场景")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="重放速度: 1 为录制时的速度，10 为十倍速，0 为不等待 (默认)")
+    parser.add_argument('--config', help="重放时使用的配置文件 (过滤、去重、路由、发送队列等)")
+    parser.add_argument('--keep-rate-limit', action='store_true', help="重放时保留配置文件中的限速设置")
+    parser.add_argument('--output', help="把结果写入JSON文件")
+    parser.add_argument('--baseline', help="与之前保存的JSON结果比较吞吐量")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="吞吐量下降超过该比例时以非零状态退出 (默认0.2)")
+    parser.add_argument('--no-isolate', action='store_true', help="在同一个进程中运行所有场景")
+    parser.add_argument('--log-level', default='ERROR', help="同步工具的日志级别")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_scenario(args.child, args)), ensure_ascii=False))
+        return 0
+
+    results = []
+    if args.replay:
+        results.append(asyncio.run(run_replay(args)))
+    else:
+        names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            print(f"未知的场景: {', '.join(unknown)}", file=sys.stderr)
+            return 2
+        for name in names:
+            print(f"运行 {name} ...", file=sys.stderr)
+            if args.no_isolate:
+                results.append(asyncio.run(run_scenario(name, args)))
+            else:
+                results.append(run_isolated(name, args))
+
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        regressions = compare_baseline(results, args.baseline, args.max_regression)
+        for name, previous, current in regressions:
+            print(f"性能下降: {name} {previous} -> {current} 条/秒", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
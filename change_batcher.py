@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+编辑/删除合并 - 短时间内的多次编辑只提交最后一个版本，删除按源攒批提交
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EditCoalescer:
+    """合并对同一条消息的连续编辑
+
+    第一次编辑后等待 delay 秒再提交，期间的后续编辑只替换待提交的版本、不重新计时，
+    所以编辑最多延迟 delay 秒，连续修改错别字时只发送一次。
+    提交时调用 callback(source_chat_id, message)。
+    """
+
+    def __init__(self, callback, delay=2.0):
+        self.callback = callback
+        self.delay = delay
+        self.pending = {}  # (源ID, 消息ID) -> [最新版本的消息, 定时器]
+        self.tasks = set()
+
+    def add(self, source_chat_id, message):
+        """记录一次编辑"""
+        key = (source_chat_id, message.id)
+        entry = self.pending.get(key)
+        if entry is not None:
+            entry[0] = message
+            return
+        timer = asyncio.get_running_loop().call_later(self.delay, self._flush, key)
+        self.pending[key] = [message, timer]
+
+    def _flush(self, key):
+        """提交最新版本"""
+        entry = self.pending.pop(key, None)
+        if entry is None:
+            return
+        message, timer = entry
+        timer.cancel()
+        task = asyncio.create_task(self.callback(key[0], message))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush_all(self):
+        """立即提交所有待提交的编辑并等待处理结束"""
+        for key in list(self.pending):
+            self._flush(key)
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+class DeleteBatcher:
+    """按源收集被删除的消息ID
+
+    收到第一条删除后等待 delay 秒，或攒满 max_batch 条时，
+    把这一批交给 callback(source_chat_id, message_ids) 处理。
+    """
+
+    def __init__(self, callback, delay=1.0, max_batch=100):
+        self.callback = callback
+        self.delay = delay
+        self.max_batch = max_batch
+        self.pending = {}  # 源ID -> [消息ID列表, 定时器]
+        self.tasks = set()
+
+    def add(self, source_chat_id, message_ids):
+        """记录一次删除"""
+        entry = self.pending.get(source_chat_id)
+        if entry is None:
+            timer = asyncio.get_running_loop().call_later(self.delay, self._flush, source_chat_id)
+            entry = self.pending[source_chat_id] = [[], timer]
+        entry[0].extend(message_ids)
+        if len(entry[0]) >= self.max_batch:
+            self._flush(source_chat_id)
+
+    def _flush(self, source_chat_id):
+        """提交一批删除"""
+        entry = self.pending.pop(source_chat_id, None)
+        if entry is None:
+            return
+        message_ids, timer = entry
+        timer.cancel()
+        task = asyncio.create_task(self.callback(source_chat_id, message_ids))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush_all(self):
+        """立即提交所有待提交的删除并等待处理结束"""
+        for source_chat_id in list(self.pending):
+            self._flush(source_chat_id)
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+发送账号池 - 多个有目标频道发言权限的账号/机器人分担发送请求，突破单个账号的限速
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Sender:
+    """池中的一个发送账号
+
+    - client: 该账号的Telegram客户端
+    - limiter: 该账号独立的限速器，FloodWait只影响这个账号
+    - main: 是否为主账号 (负责接收消息、读取历史，唯一能引用源消息和源媒体的账号)
+    - peers: 该账号解析出的 目标ID -> InputPeer (access_hash 因账号而异)
+    - unreachable: 该账号无法访问的目标
+    - pending: 已分配但尚未完成的请求数
+    """
+
+    __slots__ = ('name', 'client', 'limiter', 'main', 'peers', 'unreachable', 'pending')
+
+    def __init__(self, name, client, limiter, main=False):
+        self.name = name
+        self.client = client
+        self.limiter = limiter
+        self.main = main
+        self.peers = {}
+        self.unreachable = set()
+        self.pending = 0
+
+
+class ClientPool:
+    """按各账号的限速状态分配发送请求
+
+    每次选择预计最早能发出请求的账号: 正在FloodWait的账号会被避开，
+    令牌相同时选择排队请求最少的账号。目标频道中的消息ID对所有成员相同，
+    所以无论由哪个账号发送，消息ID映射都保持一致。
+    """
+
+    def __init__(self, include_main=True, upload_media=False):
+        self.include_main = include_main
+        self.upload_media = upload_media
+        self.senders = []
+
+    @property
+    def main(self):
+        return next((sender for sender in self.senders if sender.main), None)
+
+    def add(self, name, client, limiter, main=False):
+        """加入一个发送账号"""
+        sender = Sender(name, client, limiter, main)
+        self.senders.append(sender)
+        return sender
+
+    def candidates(self, chat=None, exclude=()):
+        """可以发送到 chat 的账号，跳过无法访问它的账号和 exclude 中的账号"""
+        return [
+            sender for sender in self.senders
+            if (self.include_main or not sender.main)
+            and chat not in sender.unreachable and sender not in exclude
+        ]
+
+    def pick(self, main_only=False, chat=None, exclude=()):
+        """选择下一个请求使用的账号，没有其他可用账号时返回主账号
+
+        main_only: 请求引用了源消息或源媒体，只能由主账号发送
+        chat: 目标频道
+        exclude: 本次请求已经触发FloodWait的账号
+        """
+        candidates = [] if main_only else self.candidates(chat, exclude)
+        if not candidates:
+            return self.main
+        return min(candidates, key=lambda sender: sender.limiter.delay() + sender.pending / sender.limiter.rate)
+
+    def helpers(self):
+        """主账号以外的发送账号"""
+        return [sender for sender in self.senders if not sender.main]
+
+    def flood_wait_seconds(self):
+        """各账号累计收到的FloodWait秒数"""
+        return [({'account': sender.name}, sender.limiter.flood_wait_seconds) for sender in self.senders]
+
+    def rates(self):
+        """各账号当前的发送速率"""
+        return [({'account': sender.name}, sender.limiter.rate) for sender in self.senders]
+
+    async def disconnect(self):
+        """断开主账号以外的客户端"""
+        for sender in self.helpers():
+            try:
+                await sender.client.disconnect()
+            except Exception as e:
+                logger.warning(f"断开发送账号 {sender.name} 失败: {e}")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+重复内容过滤 - 按规范化文本指纹、SimHash和媒体ID识别多个源转发的相同内容
+"""
+
+import hashlib
+import re
+import unicodedata
+from collections import OrderedDict
+
+# 规范化时去掉链接、标点和空白，只保留文字
+URL_PATTERN = re.compile(r'https?://\S+|t\.me/\S+')
+NON_WORD_PATTERN = re.compile(r'[\W_]+')
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4  # 汉明距离不超过 BANDS-1 的指纹至少有一段完全相同
+SIMHASH_MAX_CHARS = 2000
+
+
+def normalize_text(text):
+    """全角半角统一、忽略大小写、去掉链接和标点空白"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = URL_PATTERN.sub(' ', text)
+    return NON_WORD_PATTERN.sub('', text)
+
+
+def simhash(text):
+    """按字符3-gram计算64位SimHash，中文和英文都适用"""
+    text = text[:SIMHASH_MAX_CHARS]
+    shingles = {text[i:i + 3] for i in range(max(1, len(text) - 2))}
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def simhash_bands(value):
+    """把指纹切成若干段，作为近似重复的候选索引"""
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    mask = (1 << width) - 1
+    return [(band, value >> (band * width) & mask) for band in range(SIMHASH_BANDS)]
+
+
+class Fingerprint:
+    """一条消息 (或一个相册) 的内容指纹
+
+    targets 为这份内容已经发送 (或正在发送) 到的目标 -> 发送它的 (源ID, 消息ID元组)，
+    sending 为正在发送的目标 -> 发送结束时触发的事件。
+    """
+
+    __slots__ = ('exact', 'simhash', 'media', 'timestamp', 'source_chat_id', 'message_ids', 'targets', 'sending')
+
+    def __init__(self, exact, simhash_value, media, timestamp, source_chat_id, message_ids):
+        self.exact = exact
+        self.simhash = simhash_value
+        self.media = media
+        self.timestamp = timestamp
+        self.source_chat_id = source_chat_id
+        self.message_ids = message_ids
+        self.targets = {}
+        self.sending = {}
+
+
+class DuplicateIndex:
+    """有时间窗口和容量上限的指纹索引
+
+    - 完全重复: 规范化文本 + 媒体ID相同
+    - 近似重复: 媒体ID相同且文本SimHash的汉明距离不超过 max_distance (最大为 SIMHASH_BANDS-1)
+    只有时间相差不超过 window 秒的消息才视为重复；超过 max_entries 时淘汰最早的指纹。
+    文本少于 min_length 个字且没有媒体的消息不参与去重，避免误伤简短回复。
+    指纹记录内容已经发送到的目标，只对已经收到这份内容的目标跳过。
+    """
+
+    def __init__(self, window=86400, max_entries=50000, near_duplicates=True, max_distance=3, min_length=10):
+        self.window = window
+        self.max_entries = max_entries
+        self.near_duplicates = near_duplicates
+        self.max_distance = min(max_distance, SIMHASH_BANDS - 1)
+        self.min_length = min_length
+        self.entries = OrderedDict()  # 完全指纹 -> Fingerprint，按加入顺序
+        self.bands = {}  # (段号, 段值) -> {完全指纹, ...}
+        self.latest = 0
+
+    def fingerprint(self, text, media_keys, timestamp, source_chat_id, message_ids):
+        """计算指纹，不参与去重的消息返回None"""
+        normalized = normalize_text(text)
+        media = '|'.join(key for key in media_keys if key)
+        if not media and len(normalized) < self.min_length:
+            return None
+        exact = hashlib.sha1(f"{media}\x00{normalized}".encode()).hexdigest()
+        value = simhash(normalized) if self.near_duplicates and len(normalized) >= self.min_length else None
+        return Fingerprint(exact, value, media, timestamp, source_chat_id, message_ids)
+
+    def find(self, fingerprint):
+        """查找时间窗口内与指纹重复的已记录消息，没有时返回None"""
+        match = self.entries.get(fingerprint.exact)
+        if match is not None and abs(fingerprint.timestamp - match.timestamp) <= self.window:
+            return match
+        if fingerprint.simhash is None:
+            return None
+        for band in simhash_bands(fingerprint.simhash):
+            for exact in self.bands.get(band, ()):
+                candidate = self.entries[exact]
+                if (candidate.media == fingerprint.media
+                        and abs(fingerprint.timestamp - candidate.timestamp) <= self.window
+                        and bin(candidate.simhash ^ fingerprint.simhash).count('1') <= self.max_distance):
+                    return candidate
+        return None
+
+    def claim(self, fingerprint):
+        """返回时间窗口内内容相同的已记录指纹；没有时记录并返回这个新指纹"""
+        match = self.find(fingerprint)
+        if match is not None:
+            return match
+        self.add(fingerprint)
+        return fingerprint
+
+    def add(self, fingerprint):
+        """记录指纹，并淘汰超出时间窗口或容量的旧指纹"""
+        self.remove(fingerprint.exact)
+        self.entries[fingerprint.exact] = fingerprint
+        if fingerprint.simhash is not None:
+            for band in simhash_bands(fingerprint.simhash):
+                self.bands.setdefault(band, set()).add(fingerprint.exact)
+        self.latest = max(self.latest, fingerprint.timestamp)
+        while self.entries:
+            oldest = next(iter(self.entries.values()))
+            if len(self.entries) <= self.max_entries and self.latest - oldest.timestamp <= self.window:
+                break
+            self.remove(oldest.exact)
+
+    def remove(self, exact):
+        fingerprint = self.entries.pop(exact, None)
+        if fingerprint is None or fingerprint.simhash is None:
+            return
+        for band in simhash_bands(fingerprint.simhash):
+            members = self.bands.get(band)
+            if members is not None:
+                members.discard(exact)
+                if not members:
+                    del self.bands[band]
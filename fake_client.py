@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+模拟的Telegram客户端 - 不联网，按配置的延迟、FloodWait概率和媒体大小模拟请求，
+供基准测试在CI中运行完整的同步流程
+"""
+
+import asyncio
+import os
+import random
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from telethon import utils
+from telethon.errors import FileReferenceExpiredError, FloodWaitError
+from telethon.tl.types import DocumentAttributeFilename, InputDocument, InputPeerChannel, InputPhoto
+
+# 合成文本使用的词表，包含中英文以覆盖规范化和SimHash的常见输入
+WORDS = (
+    '今天', '市场', '消息', '更新', '价格', '上涨', '下跌', '公告', '频道', '活动',
+    'the', 'price', 'update', 'release', 'breaking', 'news', 'market', 'report', 'link', 'data',
+)
+
+
+class FakeReply:
+    __slots__ = ('reply_to_msg_id',)
+
+    def __init__(self, reply_to_msg_id):
+        self.reply_to_msg_id = reply_to_msg_id
+
+
+class FakeDocument:
+    """文档 (视频、文件等)，size 决定下载和上传的模拟耗时"""
+
+    __slots__ = ('id', 'access_hash', 'file_reference', 'size', 'mime_type', 'attributes')
+
+    def __init__(self, document_id, size, mime_type='video/mp4', file_name=None):
+        self.id = document_id
+        self.access_hash = document_id * 7 + 1
+        self.file_reference = b'ref'
+        self.size = size
+        self.mime_type = mime_type
+        self.attributes = [DocumentAttributeFilename(file_name or f"file_{document_id}.mp4")]
+
+
+class FakePhoto:
+    __slots__ = ('id', 'access_hash', 'file_reference', 'size')
+
+    def __init__(self, photo_id, size):
+        self.id = photo_id
+        self.access_hash = photo_id * 7 + 1
+        self.file_reference = b'ref'
+        self.size = size
+
+
+class FakeMessage:
+    """与Telethon消息对象兼容的最小子集"""
+
+    __slots__ = ('id', 'chat_id', 'text', 'date', 'reply_to', 'grouped_id', 'document', 'photo', 'media')
+
+    def __init__(self, message_id, chat_id, text='', date=None, reply_to=None, grouped_id=None,
+                 document=None, photo=None):
+        self.id = message_id
+        self.chat_id = chat_id
+        self.text = text
+        self.date = date or datetime.now(timezone.utc)
+        self.reply_to = FakeReply(reply_to) if reply_to else None
+        self.grouped_id = grouped_id
+        self.document = document
+        self.photo = photo
+        self.media = document or photo
+
+
+class FakeEntity:
+    __slots__ = ('id', 'title', 'broadcast')
+
+    def __init__(self, chat_id):
+        self.id = chat_id
+        self.title = f"模拟频道 {chat_id}"
+        self.broadcast = True
+
+
+class FakeEvent:
+    """NewMessage事件"""
+
+    __slots__ = ('chat_id', 'message')
+
+    def __init__(self, chat_id, message):
+        self.chat_id = chat_id
+        self.message = message
+
+
+class FakeSender:
+    """发送器，与Telethon一样由 _transport_connected 反映底层连接的状态"""
+
+    def __init__(self):
+        self.transport = True
+
+    def _transport_connected(self):
+        return self.transport
+
+
+class Workload:
+    """一个源的合成消息，ID从1到count
+
+    - reply_ratio: 回复前面某条消息的比例
+    - media_ratio: 带媒体 (图片或文档) 的比例，文档大小在 media_size 的 0.5~1.5 倍之间
+    - album_ratio: 媒体消息中属于相册的比例，每个相册2~10个文件
+    - repeat_media_ratio: 媒体重复使用之前出现过的文件 (转载) 的比例，用于测试媒体缓存
+    消息布局在创建时按 seed 确定，同一参数每次生成相同的消息。
+    """
+
+    def __init__(self, count, text_length=30, reply_ratio=0.2, media_ratio=0.0, album_ratio=0.0,
+                 media_size=512 * 1024, repeat_media_ratio=0.0, seed=0):
+        self.count = count
+        self.text_length = text_length
+        self.seed = seed
+        self.start_date = datetime.now(timezone.utc) - timedelta(seconds=count)
+        # 每条消息的布局: (相册ID, 媒体类型, 媒体ID, 大小, 回复的消息ID)
+        self.plan = [None]
+        rng = random.Random(seed)
+        message_id = 1
+        media_ids = []
+        while message_id <= count:
+            if rng.random() < media_ratio:
+                group = rng.randint(2, 10) if rng.random() < album_ratio else 1
+                group = min(group, count - message_id + 1)
+                grouped_id = seed * 10 ** 9 + message_id if group > 1 else None
+                for _ in range(group):
+                    if media_ids and rng.random() < repeat_media_ratio:
+                        kind, media_id, size = rng.choice(media_ids)
+                    else:
+                        kind = 'photo' if rng.random() < 0.5 else 'document'
+                        size = rng.randint(50 * 1024, 300 * 1024) if kind == 'photo' else \
+                            int(media_size * rng.uniform(0.5, 1.5))
+                        media_id = seed * 10 ** 9 + message_id
+                        media_ids.append((kind, media_id, size))
+                    self.plan.append((grouped_id, kind, media_id, size, None))
+                    message_id += 1
+            else:
+                reply_to = rng.randint(1, message_id - 1) if message_id > 1 and rng.random() < reply_ratio else None
+                self.plan.append((None, None, None, 0, reply_to))
+                message_id += 1
+
+    @property
+    def last_id(self):
+        return self.count
+
+    def ids(self, min_id=0):
+        """ID大于 min_id 的消息ID，从旧到新"""
+        return range(min_id + 1, self.count + 1)
+
+    def message(self, chat_id, message_id):
+        """生成一条消息，ID超出范围时返回None"""
+        if not 1 <= message_id <= self.count:
+            return None
+        grouped_id, kind, media_id, size, reply_to = self.plan[message_id]
+        rng = random.Random(self.seed * 1000003 + message_id)
+        text = f"#{message_id} " + ' '.join(rng.choices(WORDS, k=self.text_length))
+        document = FakeDocument(media_id, size) if kind == 'document' else None
+        photo = FakePhoto(media_id, size) if kind == 'photo' else None
+        return FakeMessage(
+            message_id, chat_id, text,
+            date=self.start_date + timedelta(seconds=message_id),
+            reply_to=reply_to,
+            grouped_id=grouped_id,
+            document=document,
+            photo=photo
+        )
+
+
+def message_from_record(chat_id, record):
+    """从录制的记录还原消息 (见 stream_recorder.describe_message)"""
+    media = record.get('media') or {}
+    document = photo = None
+    if media.get('kind') == 'photo':
+        photo = FakePhoto(media.get('id') or 0, media.get('size') or 0)
+    elif media:
+        document = FakeDocument(
+            media.get('id') or 0, media.get('size') or 0,
+            mime_type=media.get('mime', 'application/octet-stream'), file_name=media.get('name')
+        )
+    date = datetime.fromtimestamp(record['date'], timezone.utc) if record.get('date') else None
+    return FakeMessage(
+        record['id'], chat_id, record.get('text') or '',
+        date=date,
+        reply_to=record.get('reply_to'),
+        grouped_id=record.get('grouped_id'),
+        document=document,
+        photo=photo
+    )
+
+
+class RecordedWorkload:
+    """录制的历史消息，与 Workload 接口相同"""
+
+    def __init__(self, chat_id, records):
+        self.messages = {record['id']: message_from_record(chat_id, record) for record in records}
+        self.order = sorted(self.messages)
+
+    @property
+    def count(self):
+        return len(self.order)
+
+    @property
+    def last_id(self):
+        return self.order[-1] if self.order else 0
+
+    def ids(self, min_id=0):
+        return [message_id for message_id in self.order if message_id > min_id]
+
+    def message(self, chat_id, message_id):
+        return self.messages.get(message_id)
+
+
+class FakeTelegramClient:
+    """实现同步工具用到的 TelegramClient 方法
+
+    - latency / jitter: 每个请求的基础延迟和随机抖动 (秒)
+    - flood_rate: 发送请求触发FloodWait的概率，等待 flood_seconds 秒 (可以是小数)
+    - reference_failure_rate: 按引用发送源媒体失败的概率，失败后走下载并重新上传的流程
+    - bandwidth: 下载和上传的带宽 (字节/秒)，None表示不按文件大小计算耗时
+    - history_page: iter_messages 每次请求返回的消息数，每页一次延迟
+    """
+
+    def __init__(self, workloads=None, latency=0.0, jitter=0.0, flood_rate=0.0, flood_seconds=1,
+                 reference_failure_rate=0.0, bandwidth=None, history_page=100, seed=0):
+        self.workloads = workloads or {}  # 源ID -> Workload 或 RecordedWorkload
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.reference_failure_rate = reference_failure_rate
+        self.bandwidth = bandwidth
+        self.history_page = history_page
+        self.random = random.Random(seed)
+        self.handlers = []  # (事件构造器, 处理函数)
+        self.next_ids = {}  # 目标ID -> 下一条消息ID
+        self.sent_media = {}  # (目标ID, 消息ID) -> 发送的媒体消息，用于重新获取文件引用
+        self.calls = {}  # 方法名 -> 调用次数
+        self.floods = 0
+        self.uploaded_bytes = 0
+        self.downloaded_bytes = 0
+        self.connected = True  # 与Telethon的 is_connected 一致: 只在主动断开后为False，自动重连期间不变
+        self._sender = FakeSender()
+        self.disconnected = asyncio.Event()
+
+    @staticmethod
+    def chat_id(peer):
+        return peer if isinstance(peer, int) else utils.get_peer_id(peer)
+
+    async def request(self, method, size=0, send=False):
+        """模拟一次请求的网络延迟，发送请求按概率抛出FloodWait"""
+        self.calls[method] = self.calls.get(method, 0) + 1
+        delay = self.latency + (self.random.random() * self.jitter if self.jitter else 0)
+        if size and self.bandwidth:
+            delay += size / self.bandwidth
+        await asyncio.sleep(delay)
+        if send and self.flood_rate and self.random.random() < self.flood_rate:
+            self.floods += 1
+            error = FloodWaitError(request=None, capture=0)
+            error.seconds = self.flood_seconds
+            raise error
+
+    def new_message(self, target, **kwargs):
+        target = self.chat_id(target)
+        message_id = self.next_ids.get(target, 0) + 1
+        self.next_ids[target] = message_id
+        return FakeMessage(message_id, target, **kwargs)
+
+    def sent_count(self):
+        """所有目标中已发送的消息数"""
+        return sum(self.next_ids.values())
+
+    # 连接和事件
+
+    async def start(self, *args, **kwargs):
+        return self
+
+    def is_connected(self):
+        return self.connected
+
+    async def disconnect(self):
+        self.connected = False
+        self._sender.transport = False
+        self.disconnected.set()
+
+    async def drop_connection(self, seconds):
+        """模拟网络中断: 底层连接断开 seconds 秒后自动重连，期间 is_connected 仍为True"""
+        self._sender.transport = False
+        await asyncio.sleep(seconds)
+        self._sender.transport = True
+
+    async def run_until_disconnected(self):
+        await self.disconnected.wait()
+
+    def on(self, event):
+        def decorator(func):
+            self.add_event_handler(func, event)
+            return func
+        return decorator
+
+    def add_event_handler(self, func, event):
+        self.handlers.append((event, func))
+
+    def remove_event_handler(self, func, event=None):
+        self.handlers = [(builder, handler) for builder, handler in self.handlers
+                         if not (handler is func and (event is None or builder is event))]
+
+    async def emit(self, chat_id, message):
+        """向注册的NewMessage处理器派发一条新消息"""
+        event = FakeEvent(chat_id, message)
+        for builder, func in self.handlers:
+            if type(builder).__name__ == 'NewMessage':
+                await func(event)
+
+    def live_message(self, chat_id, message_id):
+        """生成一条时间为当前时间的实时消息"""
+        message = self.workloads[chat_id].message(chat_id, message_id)
+        message.date = datetime.now(timezone.utc)
+        return message
+
+    # 实体
+
+    async def get_input_entity(self, chat):
+        if isinstance(chat, str):
+            # 用户名按名称生成固定的频道ID
+            channel_id = zlib.crc32(chat.lstrip('@').lower().encode())
+            return InputPeerChannel(channel_id, channel_id * 7 + 1)
+        if not isinstance(chat, int):
+            return chat
+        channel_id = int(str(chat)[4:]) if str(chat).startswith('-100') else abs(chat)
+        return InputPeerChannel(channel_id, channel_id * 7 + 1)
+
+    async def get_entity(self, chat):
+        await self.request('get_entity')
+        return FakeEntity(self.chat_id(chat))
+
+    async def iter_dialogs(self):
+        for chat_id in self.workloads:
+            yield type('FakeDialog', (), {'id': chat_id, 'name': str(chat_id), 'entity': FakeEntity(chat_id)})()
+
+    # 读取消息
+
+    async def get_messages(self, peer, limit=None, ids=None, **kwargs):
+        await self.request('get_messages')
+        chat = self.chat_id(peer)
+        if ids is not None:
+            workload = self.workloads.get(chat)
+            if workload is not None:
+                return workload.message(chat, ids)
+            return self.sent_media.get((chat, ids))
+        workload = self.workloads.get(chat)
+        if workload is None or not workload.count:
+            return []
+        ids = list(workload.ids())[-(limit or 1):]
+        return [workload.message(chat, message_id) for message_id in reversed(ids)]
+
+    async def iter_messages(self, peer, limit=None, offset_date=None, min_id=0, reverse=False, **kwargs):
+        chat = self.chat_id(peer)
+        workload = self.workloads.get(chat)
+        if workload is None:
+            return
+        if offset_date is not None and offset_date.tzinfo is None:
+            offset_date = offset_date.astimezone(timezone.utc)
+        ids = workload.ids(min_id)
+        if not reverse:
+            ids = reversed(ids)
+        returned = 0
+        for message_id in ids:
+            if limit is not None and returned >= limit:
+                return
+            message = workload.message(chat, message_id)
+            if offset_date is not None and (message.date < offset_date if reverse else message.date > offset_date):
+                continue
+            if returned % self.history_page == 0:
+                await self.request('iter_messages')
+            returned += 1
+            yield message
+
+    async def download_media(self, message, file=None, **kwargs):
+        media = message.document or message.photo
+        await self.request('download_media', media.size)
+        self.downloaded_bytes += media.size
+        path = file if file and not file.endswith(os.sep) else os.path.join(file or '.', f"{media.id}.bin")
+        # 稀疏文件: 哈希时按完整大小读取，但不占用磁盘
+        with open(path, 'wb') as f:
+            f.truncate(media.size)
+        return path
+
+    # 发送
+
+    def media_for(self, file):
+        """把发送的文件 (源媒体、缓存的引用或本地路径) 转换为目标端的媒体对象，返回 (媒体, 上传的字节数)"""
+        if isinstance(file, str):
+            size = os.path.getsize(file)
+            media_id = self.random.getrandbits(48)
+            return FakeDocument(media_id, size), size
+        if isinstance(file, (FakeDocument, FakePhoto)):
+            if self.reference_failure_rate and self.random.random() < self.reference_failure_rate:
+                raise ValueError("MEDIA_INVALID (模拟)")
+            return file, 0
+        if isinstance(file, (InputDocument, InputPhoto)):
+            if file.file_reference != b'ref':
+                raise FileReferenceExpiredError(request=None)
+            if isinstance(file, InputPhoto):
+                return FakePhoto(file.id, 0), 0
+            return FakeDocument(file.id, 0), 0
+        return file, 0
+
+    async def send_message(self, entity, message='', reply_to=None, **kwargs):
+        await self.request('send_message', send=True)
+        return self.new_message(entity, text=message, reply_to=reply_to)
+
+    async def send_file(self, entity, file, caption=None, reply_to=None, **kwargs):
+        files = file if isinstance(file, list) else [file]
+        captions = caption if isinstance(caption, list) else [caption] + [None] * (len(files) - 1)
+        converted = [self.media_for(item) for item in files]
+        size = sum(uploaded for _, uploaded in converted)
+        await self.request('send_file', size, send=True)
+        self.uploaded_bytes += size
+        sent = []
+        for (media, _), text in zip(converted, captions):
+            message = self.new_message(
+                entity, text=text or '', reply_to=reply_to,
+                document=media if isinstance(media, FakeDocument) else None,
+                photo=media if isinstance(media, FakePhoto) else None
+            )
+            self.sent_media[(message.chat_id, message.id)] = message
+            sent.append(message)
+        return sent if isinstance(file, list) else sent[0]
+
+    async def forward_messages(self, entity, messages, from_peer=None, **kwargs):
+        await self.request('forward_messages', send=True)
+        ids = messages if isinstance(messages, list) else [messages]
+        return [self.new_message(entity) for _ in ids]
+
+    async def edit_message(self, entity, message=None, text=None, **kwargs):
+        await self.request('edit_message', send=True)
+        return FakeMessage(message, self.chat_id(entity), text or '')
+
+    async def delete_messages(self, entity, message_ids, **kwargs):
+        await self.request('delete_messages', send=True)
+        return []
+
+    def stats(self):
+        """请求统计"""
+        return {
+            'calls': dict(self.calls),
+            'flood_waits': self.floods,
+            'sent_messages': self.sent_count(),
+            'uploaded_bytes': self.uploaded_bytes,
+            'downloaded_bytes': self.downloaded_bytes,
+        }
@@ -101,6 +101,8 @@ async def main():
         print("无效的选择")
     
     await syncer.client.disconnect()
+    await syncer.sender_pool.disconnect()
+    syncer.close()
     print("\n历史消息同步完成!")
 
 if __name__ == "__main__":
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+媒体缓存 - 重新上传过的文件按源文档ID和内容哈希记录目标端的媒体引用，
+再次出现时直接按引用发送；下载的文件暂存在有容量上限的本地目录中，按LRU淘汰
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from telethon.tl.types import InputDocument, InputPhoto
+
+from state_store import open_state_db
+
+logger = logging.getLogger(__name__)
+
+
+def source_media_key(message):
+    """源消息中媒体的缓存键 (同一文件被转发到不同频道时文档ID不变)，没有可用ID时返回None"""
+    document = getattr(message, 'document', None)
+    if document is not None and getattr(document, 'id', None):
+        return f"document:{document.id}"
+    photo = getattr(message, 'photo', None)
+    if photo is not None and getattr(photo, 'id', None):
+        return f"photo:{photo.id}"
+    return None
+
+
+def hash_file(path):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    """已上传媒体的引用索引 + 本地暂存目录
+
+    - 索引: 缓存键 (document:<ID> / photo:<ID> / sha256:<哈希>) -> 目标端的媒体引用，
+      以及可以重新获取文件引用的目标消息
+    - 暂存目录: 每个缓存键一个子目录，总大小超过 spool_size 时淘汰最久未使用且未在使用中的文件
+    """
+
+    def __init__(self, db_path='sync_state.db', spool_dir='media_spool', spool_size=1024 * 1024 * 1024):
+        self.conn = open_state_db(db_path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS media_cache ('
+            ' cache_key TEXT PRIMARY KEY,'
+            ' media_type TEXT NOT NULL,'
+            ' media_id INTEGER NOT NULL,'
+            ' access_hash INTEGER NOT NULL,'
+            ' file_reference BLOB NOT NULL,'
+            ' target_chat TEXT NOT NULL,'
+            ' target_msg_id INTEGER NOT NULL,'
+            ' updated_at REAL NOT NULL'
+            ')'
+        )
+        self.conn.commit()
+        self.spool_dir = spool_dir
+        self.spool_size = spool_size
+        self.spooled = OrderedDict()  # 子目录名 -> 字节数，按最近使用排序
+        self.pins = {}   # 子目录名 -> 正在使用的次数
+        self.locks = {}  # 缓存键 -> 下载锁，同一文件同时只下载一次
+        self.load_spool()
+
+    def load_spool(self):
+        """按修改时间载入暂存目录中已有的文件 (暂存目录在第一次下载时才创建)"""
+        if not os.path.isdir(self.spool_dir):
+            return
+        entries = []
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), name, size))
+        for _, name, size in sorted(entries):
+            self.spooled[name] = size
+
+    def get(self, cache_key):
+        """查询已上传的媒体，返回 (可发送的媒体引用, 目标频道, 目标消息ID) 或None"""
+        if not cache_key:
+            return None
+        row = self.conn.execute(
+            'SELECT media_type, media_id, access_hash, file_reference, target_chat, target_msg_id '
+            'FROM media_cache WHERE cache_key = ?',
+            (cache_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        media_type, media_id, access_hash, file_reference, target_chat, target_msg_id = row
+        media_class = InputPhoto if media_type == 'photo' else InputDocument
+        return media_class(media_id, access_hash, file_reference), target_chat, target_msg_id
+
+    def put(self, cache_keys, message, target_chat):
+        """记录目标消息中的媒体引用，message 没有可引用的媒体时忽略"""
+        media = getattr(message, 'document', None)
+        media_type = 'document'
+        if media is None:
+            media = getattr(message, 'photo', None)
+            media_type = 'photo'
+        if media is None or getattr(media, 'id', None) is None:
+            return
+        now = time.time()
+        rows = [
+            (cache_key, media_type, media.id, media.access_hash, media.file_reference,
+             str(target_chat), message.id, now)
+            for cache_key in cache_keys if cache_key
+        ]
+        try:
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO media_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        except sqlite3.Error as e:
+            logger.error(f"保存媒体缓存失败: {e}")
+
+    def delete(self, cache_key):
+        """删除失效的媒体引用"""
+        try:
+            with self.conn:
+                self.conn.execute('DELETE FROM media_cache WHERE cache_key = ?', (cache_key,))
+        except sqlite3.Error as e:
+            logger.error(f"删除媒体缓存失败: {e}")
+
+    @staticmethod
+    def spool_name(cache_key):
+        return cache_key.replace(':', '_')
+
+    @asynccontextmanager
+    async def spool(self, cache_key):
+        """取得缓存键对应的暂存子目录，使用期间不会被淘汰
+
+        同一缓存键的使用者依次进入，后进入的可以直接使用已经下载好的文件。
+        出错时清空子目录，避免留下下载了一半的文件。
+        没有缓存键的媒体使用一次性目录，用完即删除。
+        """
+        temporary = cache_key is None
+        name = f"tmp_{uuid.uuid4().hex}" if temporary else self.spool_name(cache_key)
+        path = os.path.join(self.spool_dir, name)
+        self.pins[name] = self.pins.get(name, 0) + 1
+        lock = self.locks.setdefault(name, asyncio.Lock())
+        try:
+            async with lock:
+                os.makedirs(path, exist_ok=True)
+                try:
+                    yield path
+                except BaseException:
+                    shutil.rmtree(path, ignore_errors=True)
+                    raise
+        finally:
+            self.pins[name] -= 1
+            if not self.pins[name]:
+                del self.pins[name]
+                del self.locks[name]
+            if temporary or not os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                self.spooled.pop(name, None)
+            else:
+                self.spooled[name] = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                self.spooled.move_to_end(name)
+                self.evict()
+
+    @staticmethod
+    def spooled_file(path):
+        """暂存子目录中已下载的文件，没有时返回None"""
+        files = os.listdir(path)
+        return os.path.join(path, files[0]) if files else None
+
+    def spool_bytes(self):
+        return sum(self.spooled.values())
+
+    def evict(self):
+        """暂存目录超过容量时淘汰最久未使用的文件，正在使用的跳过"""
+        total = self.spool_bytes()
+        for name in list(self.spooled):
+            if total <= self.spool_size:
+                break
+            if name in self.pins:
+                continue
+            total -= self.spooled.pop(name)
+            shutil.rmtree(os.path.join(self.spool_dir, name), ignore_errors=True)
+
+    def close(self):
+        """关闭数据库"""
+        self.conn.close()
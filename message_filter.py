@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+消息过滤器 - 加载配置时把关键词预编译为前缀树形式的正则表达式和单词集合
+"""
+
+import re
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def trie_pattern(words):
+    """把一组字符串构造为前缀树形式的正则表达式，共同前缀只比较一次"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None
+    return trie_regex(trie)
+
+
+def trie_regex(node):
+    """把前缀树的一个节点转换为正则表达式，'' 键表示有字符串在这里结束"""
+    branches = []
+    chars = []
+    for char in sorted(key for key in node if key):
+        rest = trie_regex(node[char])
+        if rest:
+            branches.append(re.escape(char) + rest)
+        else:
+            chars.append(re.escape(char))
+    if len(chars) == 1:
+        branches.append(chars[0])
+    elif chars:
+        branches.append('[' + ''.join(chars) + ']')
+    if not branches:
+        return ''
+    regex = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        regex = f"(?:{regex})?"
+    return regex
+
+
+class KeywordMatcher:
+    """一组关键词和正则表达式，任一命中即匹配
+
+    - 关键词casefold后合并为前缀树形式的正则表达式，在casefold后的文本上查找，
+      每个位置沿树比较，开销不随关键词数量线性增长
+    - whole_word 时由单词字符组成的关键词放入集合，把文本切分为单词后逐个查找
+    - 用户的正则表达式单独编译，在原文上忽略大小写匹配
+    """
+
+    def __init__(self, keywords, patterns, whole_word):
+        keywords = {keyword.casefold() for keyword in keywords or [] if keyword}
+        self.words = None
+        if whole_word:
+            self.words = {keyword for keyword in keywords if WORD_PATTERN.fullmatch(keyword)}
+            keywords -= self.words
+        self.keywords = None
+        if keywords:
+            regex = trie_pattern(keywords)
+            if whole_word:
+                regex = rf"(?<!\w){regex}(?!\w)"
+            self.keywords = re.compile(regex)
+        patterns = [f"(?:{pattern})" for pattern in patterns or [] if pattern]
+        self.patterns = None
+        if patterns:
+            regex = '|'.join(patterns)
+            if whole_word:
+                regex = rf"(?<!\w)(?:{regex})(?!\w)"
+            self.patterns = re.compile(regex, re.IGNORECASE)
+
+    def search(self, text, folded=None):
+        """检查文本是否命中，folded 为已经casefold的文本 (没有时在这里计算)"""
+        if self.keywords or self.words:
+            if folded is None:
+                folded = text.casefold()
+            if self.words and not self.words.isdisjoint(WORD_PATTERN.findall(folded)):
+                return True
+            if self.keywords and self.keywords.search(folded):
+                return True
+        return bool(self.patterns and self.patterns.search(text))
+
+
+def compile_patterns(keywords, patterns, whole_word):
+    """把关键词和正则表达式编译为一个匹配器，没有规则时返回None"""
+    matcher = KeywordMatcher(keywords, patterns, whole_word)
+    if not (matcher.words or matcher.keywords or matcher.patterns):
+        return None
+    return matcher
+
+
+class MessageFilter:
+    """一组预编译的过滤规则
+
+    支持的配置项:
+    - keywords / exclude_keywords: 普通关键词 (忽略大小写)
+    - keyword_patterns / exclude_patterns: 正则表达式
+    - whole_word: 关键词是否需要整词匹配
+    - media_only / text_only: 媒体类型过滤
+    """
+
+    def __init__(self, filters):
+        whole_word = filters.get('whole_word', False)
+        self.include = compile_patterns(filters.get('keywords'), filters.get('keyword_patterns'), whole_word)
+        self.exclude = compile_patterns(filters.get('exclude_keywords'), filters.get('exclude_patterns'), whole_word)
+        self.media_only = filters.get('media_only', False)
+        self.text_only = filters.get('text_only', False)
+        self.enabled = bool(self.include or self.exclude or self.media_only or self.text_only)
+
+    def matches(self, text, has_media):
+        """检查消息是否满足过滤条件"""
+        if not self.enabled:
+            return True
+
+        if text:
+            folded = text.casefold() if self.include or self.exclude else None
+            # 关键词过滤
+            if self.include and not self.include.search(text, folded):
+                return False
+            # 排除关键词
+            if self.exclude and self.exclude.search(text, folded):
+                return False
+
+        # 媒体类型过滤
+        if self.media_only and not has_media:
+            return False
+        if self.text_only and has_media:
+            return False
+
+        return True
+
+
+class FilterEngine:
+    """全局过滤规则和按源覆盖的规则
+
+    filters.sources 中以源ID为键的规则会覆盖同名的全局配置项。
+    """
+
+    def __init__(self, filters):
+        filters = filters or {}
+        base = {key: value for key, value in filters.items() if key != 'sources'}
+        self.default = MessageFilter(base)
+        self.sources = {
+            int(str(chat_id).strip()): MessageFilter({**base, **rules})
+            for chat_id, rules in (filters.get('sources') or {}).items()
+        }
+
+    def for_source(self, source_chat_id):
+        """获取某个源适用的过滤规则"""
+        return self.sources.get(source_chat_id, self.default)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+消息分类 - 每条消息只探测一次属性，结果供过滤、发送和日志共用
+"""
+
+from telethon.tl.types import (
+    DocumentAttributeAnimated,
+    DocumentAttributeAudio,
+    DocumentAttributeFilename,
+    DocumentAttributeSticker,
+    DocumentAttributeVideo,
+)
+
+KIND_LABELS = {
+    'text': '文本',
+    'photo': '图片',
+    'video': '视频',
+    'video_note': '视频消息',
+    'audio': '音频',
+    'voice': '语音',
+    'sticker': '贴纸',
+    'animation': '动画/GIF',
+    'document': '文档',
+    'other': '其他媒体',
+    'service': '系统消息',
+    'empty': '空消息',
+}
+
+
+class MessageInfo:
+    """消息的紧凑描述
+
+    - kind: 消息类型，见 KIND_LABELS
+    - file: 发送时使用的媒体对象 (document/photo/media)，纯文本时为None
+    - mime / file_name / size: 文档的MIME类型、文件名和大小
+    - reply_to: 被回复的源消息ID
+    - grouped_id: 相册ID
+    - allowed: 过滤结果缓存，None表示尚未检查
+    """
+
+    __slots__ = ('kind', 'text', 'file', 'mime', 'file_name', 'size',
+                 'reply_to', 'grouped_id', 'allowed')
+
+    def __init__(self, kind, text=None, file=None, mime=None, file_name=None, size=None,
+                 reply_to=None, grouped_id=None):
+        self.kind = kind
+        self.text = text
+        self.file = file
+        self.mime = mime
+        self.file_name = file_name
+        self.size = size
+        self.reply_to = reply_to
+        self.grouped_id = grouped_id
+        self.allowed = None
+
+    @property
+    def has_media(self):
+        return self.file is not None
+
+    def describe(self):
+        """生成用于日志的类型描述"""
+        if self.kind in ('service', 'empty', 'text'):
+            return KIND_LABELS[self.kind]
+        label = KIND_LABELS[self.kind]
+        if self.kind == 'document':
+            label += f"({self.mime or 'unknown'}:{self.file_name or 'unnamed'})"
+        elif self.kind == 'other':
+            label += f"({type(self.file).__name__})"
+        return f"文本+{label}" if self.text else label
+
+
+def document_kind(document):
+    """根据文档属性判断具体类型，返回 (类型, 文件名)"""
+    kind = 'document'
+    file_name = None
+    for attr in getattr(document, 'attributes', None) or []:
+        if isinstance(attr, DocumentAttributeFilename):
+            file_name = attr.file_name
+        elif isinstance(attr, DocumentAttributeSticker):
+            kind = 'sticker'
+        elif isinstance(attr, DocumentAttributeAnimated):
+            if kind != 'sticker':
+                kind = 'animation'
+        elif isinstance(attr, DocumentAttributeVideo):
+            if kind == 'document':
+                kind = 'video_note' if attr.round_message else 'video'
+        elif isinstance(attr, DocumentAttributeAudio):
+            if kind == 'document':
+                kind = 'voice' if attr.voice else 'audio'
+    return kind, file_name
+
+
+def classify(message):
+    """对消息进行一次性分类"""
+    reply_to = getattr(message, 'reply_to', None)
+    reply_to = getattr(reply_to, 'reply_to_msg_id', None) if reply_to else None
+    grouped_id = getattr(message, 'grouped_id', None)
+
+    if 'MessageService' in type(message).__name__:
+        return MessageInfo('service', reply_to=reply_to, grouped_id=grouped_id)
+
+    text = getattr(message, 'text', None) or None
+    document = getattr(message, 'document', None)
+    if document:
+        kind, file_name = document_kind(document)
+        return MessageInfo(
+            kind, text, document,
+            mime=getattr(document, 'mime_type', None),
+            file_name=file_name,
+            size=getattr(document, 'size', None),
+            reply_to=reply_to,
+            grouped_id=grouped_id
+        )
+
+    photo = getattr(message, 'photo', None)
+    if photo:
+        return MessageInfo('photo', text, photo, reply_to=reply_to, grouped_id=grouped_id)
+
+    media = getattr(message, 'media', None)
+    if media:
+        return MessageInfo('other', text, media, reply_to=reply_to, grouped_id=grouped_id)
+
+    kind = 'text' if text else 'empty'
+    return MessageInfo(kind, text, reply_to=reply_to, grouped_id=grouped_id)
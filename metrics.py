@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+运行指标 - 计数器和延迟直方图，定期输出汇总日志，并可导出为 Prometheus 文本格式
+"""
+
+import asyncio
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 延迟直方图的桶上限 (秒)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def format_labels(labels):
+    """把 ((名称, 值), ...) 格式化为 Prometheus 标签文本"""
+    if not labels:
+        return ''
+    items = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        items.append(f'{key}="{value}"')
+    return '{' + ','.join(items) + '}'
+
+
+class Histogram:
+    """固定桶直方图"""
+
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶为 +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+        self.count += other.count
+
+    def percentile(self, fraction):
+        """按桶估算分位数，返回所在桶的上限"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+class MetricsRegistry:
+    """带标签的计数器和直方图
+
+    标签以关键字参数传入，例如 inc('messages_forwarded', source=-100123, kind='photo')。
+    """
+
+    def __init__(self):
+        self.counters = {}    # (名称, 标签) -> 数值
+        self.histograms = {}  # (名称, 标签) -> Histogram
+        self.gauges = {}      # 名称 -> 读取当前值的函数
+        self.observed = {}    # 名称 -> 读取累计值的函数 (由其他组件计数，导出为计数器)
+        self.reported = {}    # 上次汇总时各计数器的总数
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name, func):
+        """注册一个在导出时读取的瞬时值
+
+        func 返回一个数值，或 [(标签字典, 数值), ...] 列表。
+        """
+        self.gauges[name] = func
+
+    def counter(self, name, func):
+        """注册一个在导出时读取的累计值 (只增不减)，按计数器导出
+
+        func 的返回值与 gauge 相同。
+        """
+        self.observed[name] = func
+
+    def total(self, name):
+        """某个计数器在所有标签上的总和"""
+        return sum(value for (counter, _), value in self.counters.items() if counter == name)
+
+    def merged(self, name):
+        """某个直方图在所有标签上合并后的结果"""
+        result = Histogram()
+        for (histogram_name, _), histogram in self.histograms.items():
+            if histogram_name == name:
+                result.merge(histogram)
+        return result
+
+    def summary(self):
+        """生成一行汇总信息，包含自上次汇总以来的增量"""
+        parts = []
+        for name, label in (('messages_forwarded', '已转发'),
+                            ('messages_filtered', '已过滤'),
+                            ('messages_failed', '失败')):
+            total = self.total(name)
+            parts.append(f"{label} {total} (+{total - self.reported.get(name, 0)})")
+            self.reported[name] = total
+        latency = self.merged('send_latency_seconds')
+        if latency.count:
+            parts.append(
+                f"发送耗时 平均 {latency.total / latency.count * 1000:.0f}ms "
+                f"p50≤{latency.percentile(0.5)}s p95≤{latency.percentile(0.95)}s"
+            )
+        return ', '.join(parts)
+
+    def render_prometheus(self, prefix='telegram_sync'):
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        for name in sorted({name for name, _ in self.counters}):
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, labels), value in self.counters.items():
+                if counter == name:
+                    lines.append(f"{metric}{format_labels(labels)} {value}")
+        
+        for name in sorted({name for name, _ in self.histograms}):
+            metric = f"{prefix}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for (histogram_name, labels), histogram in self.histograms.items():
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram.total}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+        
+        for name, func in sorted(self.observed.items()):
+            self.render_value(lines, f"{prefix}_{name}_total", 'counter', name, func)
+        for name, func in sorted(self.gauges.items()):
+            self.render_value(lines, f"{prefix}_{name}", 'gauge', name, func)
+        
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def render_value(lines, metric, metric_type, name, func):
+        """读取导出时才计算的指标并追加到 lines"""
+        try:
+            value = func()
+        except Exception as e:
+            logger.warning(f"读取指标 {name} 失败: {e}")
+            return
+        lines.append(f"# TYPE {metric} {metric_type}")
+        if isinstance(value, (int, float)):
+            lines.append(f"{metric} {value}")
+        else:
+            for labels, item in value:
+                lines.append(f"{metric}{format_labels(sorted(labels.items()))} {item}")
+
+    async def run_summary(self, interval):
+        """每隔 interval 秒输出一次汇总日志"""
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(f"同步统计: {self.summary()}")
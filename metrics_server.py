@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+指标和健康检查HTTP服务 - 基于asyncio，无需额外依赖
+GET /metrics 返回 Prometheus 文本格式，GET /health 返回JSON
+"""
+
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsServer:
+    """内嵌在同步进程中的最小HTTP服务"""
+
+    def __init__(self, registry, host='127.0.0.1', port=9108, health=None):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.health = health  # 返回健康状态字典的函数
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info(f"指标服务已启动: http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader, writer):
+        """处理一个HTTP请求"""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # 读完请求头
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?', 1)[0] if len(parts) >= 2 else ''
+
+            if path == '/metrics':
+                status = '200 OK'
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                body = self.registry.render_prometheus()
+            elif path == '/health':
+                health = self.health() if self.health else {'status': 'ok'}
+                status = '200 OK' if health.get('status') == 'ok' else '503 Service Unavailable'
+                content_type = 'application/json; charset=utf-8'
+                body = json.dumps(health, ensure_ascii=False)
+            else:
+                status = '404 Not Found'
+                content_type = 'text/plain; charset=utf-8'
+                body = 'not found\n'
+
+            data = body.encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                "Connection: close\r\n\r\n".encode('latin-1') + data
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug("处理指标请求失败: %s", e)
+        finally:
+            writer.close()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+自适应限速器 - 令牌桶 + FloodWait处理
+所有发送请求共享同一个限速器，遇到FloodWait时降低速率并在等待后重试
+"""
+
+import asyncio
+import logging
+import time
+from telethon.errors import FloodWaitError
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveRateLimiter:
+    """令牌桶限速器
+
+    每次发送成功后速率线性增加，直到 max_rate；
+    收到FloodWait时速率减半，并暂停所有发送直到等待时间结束。
+    """
+
+    def __init__(self, rate=1.0, burst=3, min_rate=0.05, max_rate=20.0,
+                 increase_step=0.05, decrease_factor=0.5, max_retries=3):
+        self.rate = rate
+        self.capacity = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.flood_wait_seconds = 0  # 累计收到的FloodWait秒数
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        """按当前速率补充令牌"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """距离下一个令牌可用还需等待的秒数，用于在多个限速器之间选择"""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now + 1 / self.rate
+        tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    async def acquire(self):
+        """取得一个发送令牌，必要时等待"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        """发送成功，缓慢提高速率"""
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_flood_wait(self, seconds):
+        """收到FloodWait，降低速率并暂停发送"""
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.flood_wait_seconds += seconds
+
+    async def call_once(self, func, *args, **kwargs):
+        """在限速下执行一次发送请求，遇到FloodWait时更新限速状态后抛出"""
+        await self.acquire()
+        try:
+            result = await func(*args, **kwargs)
+        except FloodWaitError as e:
+            self.on_flood_wait(e.seconds)
+            raise
+        self.on_success()
+        return result
+
+    async def call(self, func, *args, **kwargs):
+        """在限速下执行发送请求，遇到FloodWait时等待后重试"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.call_once(func, *args, **kwargs)
+            except FloodWaitError as e:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(
+                    f"触发FloodWait，等待 {e.seconds} 秒后重试 "
+                    f"(第 {attempt + 1}/{self.max_retries} 次，当前速率 {self.rate:.2f} 条/秒)"
+                )
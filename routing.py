@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+路由表 - 每个源可以同步到一个或多个目标频道，每条路由可以附加自己的过滤规则
+"""
+
+import logging
+
+from message_filter import MessageFilter
+
+logger = logging.getLogger(__name__)
+
+
+def parse_chat_id(chat):
+    """把 "-100..." 形式的字符串ID转换为整数，用户名等其他形式保持不变"""
+    if isinstance(chat, str) and chat.strip().lstrip('-').isdigit():
+        return int(chat.strip())
+    return chat
+
+
+class Route:
+    """一个目标频道以及只对它生效的附加过滤规则 (没有时为None)"""
+
+    __slots__ = ('target', 'filter')
+
+    def __init__(self, target, message_filter=None):
+        self.target = target
+        self.filter = message_filter
+
+    def accepts(self, info):
+        """检查已分类的消息是否满足这条路由的过滤规则"""
+        return self.filter is None or self.filter.matches(info.text, info.has_media)
+
+
+class RouteTable:
+    """源ID -> [Route, ...]
+
+    routes 中的每一项:
+    - sources: 适用的源ID列表，省略时适用于所有源
+    - targets: 目标频道列表
+    - filters: 可选，在源的过滤规则之外再对这些目标生效的过滤规则
+
+    没有任何路由的源同步到 default_target (即 target_channel)。
+    同一个源重复出现的目标只保留第一条路由。
+    """
+
+    def __init__(self, source_chats, routes=None, default_target=None):
+        self.routes = {source_chat_id: [] for source_chat_id in source_chats}
+        for route in routes or []:
+            message_filter = MessageFilter(route['filters']) if route.get('filters') else None
+            sources = route.get('sources')
+            sources = [parse_chat_id(str(chat_id)) for chat_id in sources] if sources else list(source_chats)
+            for source_chat_id in sources:
+                if source_chat_id not in self.routes:
+                    logger.warning(f"路由中的源 {source_chat_id} 不在 source_chats 中，已忽略")
+                    continue
+                for target in route.get('targets', []):
+                    target = parse_chat_id(target)
+                    if all(existing.target != target for existing in self.routes[source_chat_id]):
+                        self.routes[source_chat_id].append(Route(target, message_filter))
+
+        default_target = parse_chat_id(default_target)
+        for source_chat_id, source_routes in self.routes.items():
+            if not source_routes and default_target:
+                source_routes.append(Route(default_target))
+
+    def for_source(self, source_chat_id):
+        """获取源的所有路由"""
+        return self.routes.get(source_chat_id, [])
+
+    def targets(self):
+        """所有路由涉及的目标频道 (去重，保持顺序)"""
+        seen = []
+        for source_routes in self.routes.values():
+            for route in source_routes:
+                if route.target not in seen:
+                    seen.append(route.target)
+        return seen
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+本地全文搜索 - 把同步过的消息按批写入SQLite FTS5索引，不需要调用受限速的Telegram搜索
+
+命令行用法:
+    python search_index.py 关键词 [关键词 ...] [--source 源ID] [--since 2024-01-01] [--kind video]
+    python search_index.py --from-archive archive   # 从本地归档重建索引
+"""
+
+import argparse
+import asyncio
+import logging
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from message_info import classify
+from state_store import open_state_db
+
+logger = logging.getLogger(__name__)
+
+# 中日韩文字没有空格分词，逐字切开后按相邻字组成的短语匹配，任意长度的词都能搜到
+CJK_PATTERN = re.compile('([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff])')
+
+
+def segment(text):
+    """生成写入全文索引的文本，写入和删除时必须得到相同的结果"""
+    return CJK_PATTERN.sub(r' \1 ', text) if text else ''
+
+
+def build_match(query):
+    """把搜索词转换为FTS5查询: 空格分隔的词同时匹配，词尾 * 为前缀匹配，name: 只匹配文件名"""
+    phrases = []
+    for term in query.split():
+        column = ''
+        if term.startswith('name:'):
+            column, term = 'file_name : ', term[5:]
+        prefix = term.endswith('*')
+        tokens = ' '.join(segment(term.rstrip('*')).split())
+        if not re.search(r'\w', tokens):
+            continue
+        phrase = '"' + tokens.replace('"', '""') + '"'
+        phrases.append(column + phrase + (' *' if prefix else ''))
+    return ' AND '.join(phrases)
+
+
+class SearchIndex:
+    """已同步消息的全文索引
+
+    - search_messages: 每条消息一行，(源ID, 消息ID) 唯一，保存时间、类型、文件名和原文
+    - search_terms: 无内容的FTS5表，rowid 与 search_messages.id 对应，索引分词后的文本和文件名
+    写入和删除先缓冲在内存中 (同一条消息只保留最新状态)，按批量或时间间隔在一个事务中提交。
+    """
+
+    def __init__(self, db_path='search_index.db', batch_size=500, flush_interval=5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conn = open_state_db(db_path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS search_messages ('
+            ' id INTEGER PRIMARY KEY,'
+            ' source_chat_id INTEGER NOT NULL,'
+            ' message_id INTEGER NOT NULL,'
+            ' date REAL,'
+            ' kind TEXT,'
+            ' file_name TEXT,'
+            ' text TEXT,'
+            ' UNIQUE (source_chat_id, message_id)'
+            ')'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS search_by_date ON search_messages (date)')
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_terms USING fts5(text, file_name, content='')"
+        )
+        self.conn.commit()
+        self.pending = {}  # (源ID, 消息ID) -> (时间, 类型, 文件名, 文本)，删除时为None
+        self.last_flush = time.monotonic()
+
+    def add(self, source_chat_id, message, info=None):
+        """索引一条消息，已索引的消息 (编辑) 会被替换"""
+        if info is None:
+            info = classify(message)
+        date = message.date.timestamp() if message.date else None
+        self.put(source_chat_id, message.id, (date, info.kind, info.file_name, info.text))
+
+    def add_record(self, record):
+        """索引一条归档记录 (见 archive.MessageArchive)，删除记录从索引中移除该消息"""
+        if record.get('deleted'):
+            self.put(record['source'], record['id'], None)
+            return
+        media = record.get('media', {})
+        kind = media.get('kind') or ('service' if record.get('service') else 'text')
+        self.put(record['source'], record['id'], (record.get('date'), kind, media.get('name'), record.get('text')))
+
+    def remove(self, source_chat_id, message_ids):
+        """从索引中删除一批消息"""
+        for message_id in message_ids:
+            self.put(source_chat_id, message_id, None)
+
+    def put(self, source_chat_id, message_id, fields):
+        self.pending[(source_chat_id, message_id)] = fields
+        if (len(self.pending) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """在一个事务中提交缓冲的写入和删除"""
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        try:
+            with self.conn:
+                for (source_chat_id, message_id), fields in self.pending.items():
+                    self.write(source_chat_id, message_id, fields)
+        except sqlite3.Error as e:
+            # 事务已回滚，缓冲的写入保留到下次提交
+            logger.error(f"更新搜索索引失败: {e}")
+            return
+        self.pending.clear()
+
+    def write(self, source_chat_id, message_id, fields):
+        row = self.conn.execute(
+            'SELECT id, file_name, text FROM search_messages WHERE source_chat_id = ? AND message_id = ?',
+            (source_chat_id, message_id)
+        ).fetchone()
+        if row is not None:
+            # 无内容的FTS5表需要提供原来写入的值才能删除
+            self.conn.execute(
+                "INSERT INTO search_terms (search_terms, rowid, text, file_name) VALUES ('delete', ?, ?, ?)",
+                (row[0], segment(row[2]), segment(row[1]))
+            )
+        if fields is None:
+            if row is not None:
+                self.conn.execute('DELETE FROM search_messages WHERE id = ?', (row[0],))
+            return
+        date, kind, file_name, text = fields
+        if row is None:
+            rowid = self.conn.execute(
+                'INSERT INTO search_messages (source_chat_id, message_id, date, kind, file_name, text)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (source_chat_id, message_id, date, kind, file_name, text)
+            ).lastrowid
+        else:
+            rowid = row[0]
+            self.conn.execute(
+                'UPDATE search_messages SET date = ?, kind = ?, file_name = ?, text = ? WHERE id = ?',
+                (date, kind, file_name, text, rowid)
+            )
+        self.conn.execute(
+            'INSERT INTO search_terms (rowid, text, file_name) VALUES (?, ?, ?)',
+            (rowid, segment(text), segment(file_name))
+        )
+
+    def search(self, query, source_chat_id=None, since=None, until=None, kind=None, limit=20):
+        """搜索消息，按消息时间从新到旧返回 [{source, id, date, kind, file_name, text}, ...]
+
+        since / until 为消息时间的时间戳范围。
+        """
+        self.flush()
+        match = build_match(query)
+        if not match:
+            return []
+        sql = ('SELECT m.source_chat_id, m.message_id, m.date, m.kind, m.file_name, m.text'
+               ' FROM search_terms JOIN search_messages m ON m.id = search_terms.rowid'
+               ' WHERE search_terms MATCH ?')
+        params = [match]
+        if source_chat_id is not None:
+            sql += ' AND m.source_chat_id = ?'
+            params.append(source_chat_id)
+        if since is not None:
+            sql += ' AND m.date >= ?'
+            params.append(since)
+        if until is not None:
+            sql += ' AND m.date < ?'
+            params.append(until)
+        if kind is not None:
+            sql += ' AND m.kind = ?'
+            params.append(kind)
+        # 按消息时间排序: 历史同步、补齐和从归档重建写入索引的顺序不一定是消息的时间顺序
+        sql += ' ORDER BY m.date DESC, m.id DESC LIMIT ?'
+        params.append(limit)
+        try:
+            rows = self.conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            logger.warning(f"搜索词无效: {e}")
+            return []
+        return [
+            {'source': row[0], 'id': row[1], 'date': row[2], 'kind': row[3], 'file_name': row[4], 'text': row[5]}
+            for row in rows
+        ]
+
+    async def run_flush(self):
+        """定期提交缓冲的写入，没有新消息时其他进程也能搜到最近同步的消息"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def count(self):
+        self.flush()
+        return self.conn.execute('SELECT COUNT(*) FROM search_messages').fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def parse_time(value):
+    """命令行中的时间: 时间戳或 ISO 格式的日期/时间 (本地时间)"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="搜索本地索引中已同步的消息")
+    parser.add_argument('query', nargs='*', help="搜索词，空格分隔的词同时匹配，词尾 * 为前缀匹配，name: 只匹配文件名")
+    parser.add_argument('--db', default='search_index.db', help="索引数据库 (配置中的 search.db_path)")
+    parser.add_argument('--source', type=int, help="只搜索该源ID")
+    parser.add_argument('--since', type=parse_time, help="消息时间不早于，例如 2024-01-01")
+    parser.add_argument('--until', type=parse_time, help="消息时间早于")
+    parser.add_argument('--kind', help="消息类型，例如 text、photo、video、document")
+    parser.add_argument('--limit', type=int, default=20, help="最多返回的条数")
+    parser.add_argument('--from-archive', metavar='DIRECTORY', help="从本地归档目录重建索引 (见配置中的 archive)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    index = SearchIndex(args.db, batch_size=5000)
+    try:
+        if args.from_archive:
+            from archive import MessageArchive
+            archive = MessageArchive(args.from_archive)
+            try:
+                for record in archive.scan():
+                    index.add_record(record)
+            finally:
+                archive.close()
+            print(f"索引中共有 {index.count()} 条消息")
+            if not args.query:
+                return 0
+        if not args.query:
+            print("请输入搜索词", file=sys.stderr)
+            return 2
+
+        started = time.perf_counter()
+        results = index.search(' '.join(args.query), args.source, args.since, args.until, args.kind, args.limit)
+        elapsed = (time.perf_counter() - started) * 1000
+        for result in results:
+            date = datetime.fromtimestamp(result['date']).strftime('%Y-%m-%d %H:%M') if result['date'] else '-'
+            text = ' '.join((result['text'] or '').split())
+            if len(text) > 80:
+                text = text[:80] + '...'
+            name = f" {result['file_name']}" if result['file_name'] else ''
+            print(f"{date}  {result['source']}/{result['id']}  [{result['kind']}]{name}  {text}")
+        print(f"找到 {len(results)} 条结果，用时 {elapsed:.1f} ms", file=sys.stderr)
+        return 0
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+实时消息发送队列 - 事件处理器只负责入队，由多个发送协程并发发送
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SendQueue:
+    """有界的生产者/消费者发送管道
+
+    - 每个源在每个通道中固定分配给同一个发送协程，同一通道内按入队的顺序发送
+    - 超过 large_file_size 的文件走单独的媒体通道，文本和小文件不会被大文件上传阻塞，
+      因此可能先于更早收到的大文件发送；large_file_size 为0时不使用媒体通道，同一源严格按顺序发送
+    - 回复一条仍在发送中的消息时，先等待被回复的消息发送完成，保持回复关系
+    - 队列满时入队会等待，对事件处理形成背压
+    """
+
+    def __init__(self, handler, workers=4, media_workers=2, max_size=1000, large_file_size=10 * 1024 * 1024):
+        self.handler = handler  # async handler(source_chat_id, item)
+        self.large_file_size = large_file_size
+        self.lanes = {
+            'fast': [asyncio.Queue(maxsize=max_size) for _ in range(max(1, workers))],
+            'bulk': [asyncio.Queue(maxsize=max_size) for _ in range(max(1, media_workers))],
+        }
+        self.inflight = {}  # (源ID, 消息ID) -> 发送完成事件
+        self.tasks = []
+
+    def start(self):
+        """启动发送协程"""
+        for queues in self.lanes.values():
+            for queue in queues:
+                self.tasks.append(asyncio.create_task(self.worker(queue)))
+
+    def depth(self):
+        """所有通道中等待发送的任务数"""
+        return sum(queue.qsize() for queues in self.lanes.values() for queue in queues)
+
+    async def put(self, source_chat_id, item, message_ids, size=0, reply_to=None):
+        """入队一个发送任务 (单条消息或整个相册)"""
+        lane = 'bulk' if self.large_file_size and size >= self.large_file_size else 'fast'
+        queues = self.lanes[lane]
+        queue = queues[hash(source_chat_id) % len(queues)]
+        done = asyncio.Event()
+        # 被回复的任务在入队时确定，并且任务进入队列后才登记，回复只会等待已经在队列中的任务；
+        # 否则相册收集器稍后入队的相册可能排在回复后面，同一通道互相等待而卡死。
+        # 同一条消息重复入队 (重连后重复收到的更新) 时保留先入队的那份
+        waiting = self.inflight.get((source_chat_id, reply_to)) if reply_to else None
+        await queue.put((source_chat_id, item, message_ids, waiting, done))
+        for message_id in message_ids:
+            self.inflight.setdefault((source_chat_id, message_id), done)
+
+    async def worker(self, queue):
+        """从队列取出任务并发送"""
+        while True:
+            source_chat_id, item, message_ids, waiting, done = await queue.get()
+            try:
+                if waiting is not None:
+                    await waiting.wait()
+                await self.handler(source_chat_id, item)
+            except Exception as e:
+                logger.error(f"发送队列处理消息时出错: {e}")
+            finally:
+                done.set()
+                for message_id in message_ids:
+                    if self.inflight.get((source_chat_id, message_id)) is done:
+                        del self.inflight[(source_chat_id, message_id)]
+                queue.task_done()
+
+    async def join(self):
+        """等待已入队的任务全部发送完成"""
+        for queues in self.lanes.values():
+            for queue in queues:
+                await queue.join()
+
+    async def close(self):
+        """停止发送协程"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+同步状态持久化存储 - 基于SQLite
+保存消息ID映射、同步断点和实体缓存等需要跨重启保留的状态
+"""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser
+
+logger = logging.getLogger(__name__)
+
+
+def open_state_db(db_path):
+    """打开状态数据库并设置适合频繁小写入的参数"""
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+MAPPING_TABLE = (
+    'CREATE TABLE IF NOT EXISTS message_mapping ('
+    ' source_chat_id INTEGER NOT NULL,'
+    ' source_msg_id INTEGER NOT NULL,'
+    ' target_chat TEXT NOT NULL,'
+    ' target_msg_id INTEGER NOT NULL,'
+    ' flags INTEGER NOT NULL DEFAULT 0,'
+    ' PRIMARY KEY (source_chat_id, source_msg_id, target_chat)'
+    ') WITHOUT ROWID'
+)
+
+# 映射的附加标记
+MAPPING_ALIAS = 1      # 目标消息是另一条源消息的副本 (重复内容被跳过时写入)，编辑和删除不能作用于它
+MAPPING_TIMESTAMP = 2  # 目标消息的来源信息中带有时间
+
+
+class MessageMappingStore:
+    """消息ID映射存储: (源ID, 源消息ID, 目标频道) -> (目标消息ID, 标记)
+
+    写入先进入待写缓冲区，按批量或时间间隔提交到SQLite
+    (没有新映射时由 CheckpointStore.run_flush 通过 before_flush 定期提交)；
+    读取先查待写缓冲区和LRU热缓存，未命中时按主键查询数据库。
+    目标频道以字符串保存，同时支持数字ID和用户名。
+    标记见 MAPPING_ALIAS / MAPPING_TIMESTAMP。
+    """
+
+    def __init__(self, db_path='sync_state.db', cache_size=10000, batch_size=100, flush_interval=5,
+                 default_target=None):
+        self.conn = open_state_db(db_path)
+        self.migrate(default_target)
+        self.conn.execute(MAPPING_TABLE)
+        self.conn.commit()
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.last_flush = time.monotonic()
+        self.counted = 0
+        self.counted_at = None
+
+    def migrate(self, default_target):
+        """把单目标的旧映射表迁移为按目标频道区分的新表，旧记录归属 default_target；没有标记列时补上"""
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(message_mapping)')]
+        if not columns:
+            return
+        if 'target_chat' in columns:
+            if 'flags' not in columns:
+                logger.info("迁移消息映射表: 增加标记列")
+                with self.conn:
+                    self.conn.execute('ALTER TABLE message_mapping ADD COLUMN flags INTEGER NOT NULL DEFAULT 0')
+            return
+        logger.info("迁移消息映射表: 增加目标频道列")
+        with self.conn:
+            self.conn.execute('ALTER TABLE message_mapping RENAME TO message_mapping_old')
+            self.conn.execute(MAPPING_TABLE)
+            self.conn.execute(
+                'INSERT INTO message_mapping (source_chat_id, source_msg_id, target_chat, target_msg_id) '
+                'SELECT source_chat_id, source_msg_id, ?, target_msg_id FROM message_mapping_old',
+                (str(default_target or ''),)
+            )
+            self.conn.execute('DROP TABLE message_mapping_old')
+
+    def _remember(self, key, entry):
+        """放入LRU热缓存，超出容量时淘汰最久未使用的项"""
+        self.cache[key] = entry
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get(self, source_chat_id, source_msg_id, target_chat):
+        """查询源消息在目标频道中对应的消息ID，不存在时返回None"""
+        entry = self.lookup(source_chat_id, source_msg_id, target_chat)
+        return entry[0] if entry else None
+
+    def lookup(self, source_chat_id, source_msg_id, target_chat):
+        """查询源消息在目标频道中对应的 (消息ID, 标记)，不存在时返回None"""
+        key = (source_chat_id, source_msg_id, str(target_chat))
+        if key in self.pending:
+            return self.pending[key]
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        row = self.conn.execute(
+            'SELECT target_msg_id, flags FROM message_mapping '
+            'WHERE source_chat_id = ? AND source_msg_id = ? AND target_chat = ?',
+            key
+        ).fetchone()
+        if row is None:
+            return None
+        self._remember(key, row)
+        return row
+
+    def put(self, source_chat_id, source_msg_id, target_chat, target_msg_id, flags=0):
+        """记录映射，达到批量大小或超过刷新间隔时提交"""
+        key = (source_chat_id, source_msg_id, str(target_chat))
+        entry = self.pending[key] = (target_msg_id, flags)
+        self._remember(key, entry)
+        if (len(self.pending) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """把待写缓冲区提交到数据库"""
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        rows = [key + entry for key, entry in self.pending.items()]
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO message_mapping '
+                    '(source_chat_id, source_msg_id, target_chat, target_msg_id, flags) VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+        except sqlite3.Error as e:
+            logger.error(f"保存消息映射失败: {e}")
+            return
+        self.pending.clear()
+
+    def count(self):
+        """已持久化的映射数量 (结果缓存30秒，避免频繁全表计数)"""
+        now = time.monotonic()
+        if self.counted_at is None or now - self.counted_at > 30:
+            self.counted = self.conn.execute('SELECT COUNT(*) FROM message_mapping').fetchone()[0]
+            self.counted_at = now
+        return self.counted
+
+    def close(self):
+        """提交剩余映射并关闭数据库"""
+        self.flush()
+        self.conn.close()
+
+
+class CheckpointStore:
+    """历史同步断点存储: 每个源已转发的最大消息ID (高水位)
+
+    推进断点只修改内存，累积到批量大小或超过刷新间隔时统一提交 (run_flush 在没有新消息时也定期提交)；
+    崩溃时最多丢失尚未提交的那一批进度。before_flush 在每次提交前调用，
+    用于保证消息映射先于断点落盘。
+    用 hold 登记尚未完成的消息后，断点最多推进到其中最小的ID之前，
+    重启后从那里重新获取，不会越过没有发送成功的消息。
+    """
+
+    def __init__(self, db_path='sync_state.db', batch_size=20, flush_interval=5, before_flush=None):
+        self.conn = open_state_db(db_path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoints ('
+            ' source_chat_id INTEGER PRIMARY KEY,'
+            ' last_msg_id INTEGER NOT NULL,'
+            ' updated_at REAL NOT NULL'
+            ')'
+        )
+        self.conn.commit()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.before_flush = before_flush
+        self.checkpoints = dict(
+            self.conn.execute('SELECT source_chat_id, last_msg_id FROM checkpoints').fetchall()
+        )
+        self.dirty = set()
+        self.advanced = 0
+        self.last_flush = time.monotonic()
+        self.marks = {}  # 源ID -> 请求推进到的最大消息ID (可能因未完成的消息暂时推进不到)
+        self.held = {}   # 源ID -> 尚未完成的消息ID
+
+    def get(self, source_chat_id):
+        """获取源的断点，没有记录时返回0"""
+        return self.checkpoints.get(source_chat_id, 0)
+
+    def hold(self, source_chat_id, msg_ids):
+        """登记尚未完成的消息，断点不会越过它们"""
+        self.held.setdefault(source_chat_id, set()).update(msg_ids)
+
+    def complete(self, source_chat_id, msg_ids):
+        """消息已处理完 (发送成功或按规则跳过)，取消登记并推进断点"""
+        held = self.held.get(source_chat_id)
+        if held is not None:
+            held.difference_update(msg_ids)
+            if not held:
+                del self.held[source_chat_id]
+        self.advance(source_chat_id, max(msg_ids))
+
+    def advance(self, source_chat_id, msg_id):
+        """推进源的断点，只会向前移动，并停在最小的未完成消息之前"""
+        msg_id = self.marks[source_chat_id] = max(msg_id, self.marks.get(source_chat_id, 0))
+        held = self.held.get(source_chat_id)
+        if held:
+            msg_id = min(msg_id, min(held) - 1)
+        if msg_id <= self.checkpoints.get(source_chat_id, 0):
+            return
+        self.checkpoints[source_chat_id] = msg_id
+        self.dirty.add(source_chat_id)
+        self.advanced += 1
+        if (self.advanced >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    async def run_flush(self):
+        """定期提交已推进的断点，源没有新消息时断点也不会一直留在内存中"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # 即使断点没有推进也先提交缓冲的消息映射，保证映射先于断点落盘
+            if self.before_flush:
+                self.before_flush()
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        """提交已推进的断点"""
+        self.last_flush = time.monotonic()
+        self.advanced = 0
+        if not self.dirty:
+            return
+        if self.before_flush:
+            self.before_flush()
+        now = time.time()
+        rows = [(chat_id, self.checkpoints[chat_id], now) for chat_id in self.dirty]
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT INTO checkpoints (source_chat_id, last_msg_id, updated_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(source_chat_id) DO UPDATE SET '
+                    'last_msg_id = MAX(last_msg_id, excluded.last_msg_id), updated_at = excluded.updated_at',
+                    rows
+                )
+        except sqlite3.Error as e:
+            logger.error(f"保存同步断点失败: {e}")
+            return
+        self.dirty.clear()
+
+    def close(self):
+        """提交剩余断点并关闭数据库"""
+        self.flush()
+        self.conn.close()
+
+
+def dump_peer(peer):
+    """把InputPeer转换为 (类型, ID, access_hash)，不支持的类型返回None"""
+    if isinstance(peer, InputPeerChannel):
+        return 'channel', peer.channel_id, peer.access_hash
+    if isinstance(peer, InputPeerUser):
+        return 'user', peer.user_id, peer.access_hash
+    if isinstance(peer, InputPeerChat):
+        return 'chat', peer.chat_id, 0
+    return None
+
+
+def load_peer(peer_type, peer_id, access_hash):
+    """从 (类型, ID, access_hash) 还原InputPeer"""
+    if peer_type == 'channel':
+        return InputPeerChannel(peer_id, access_hash)
+    if peer_type == 'user':
+        return InputPeerUser(peer_id, access_hash)
+    if peer_type == 'chat':
+        return InputPeerChat(peer_id)
+    return None
+
+
+class EntityCacheStore:
+    """实体缓存: 配置中的聊天ID或用户名 -> InputPeer (含access_hash)
+
+    启动时整表载入内存，之后直接从缓存构造InputPeer，不需要请求Telegram，
+    也不需要遍历对话列表。实体失效时由调用方删除对应项并重新解析。
+    """
+
+    def __init__(self, db_path='sync_state.db'):
+        self.conn = open_state_db(db_path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS entity_cache ('
+            ' chat_key TEXT PRIMARY KEY,'
+            ' peer_type TEXT NOT NULL,'
+            ' peer_id INTEGER NOT NULL,'
+            ' access_hash INTEGER NOT NULL,'
+            ' updated_at REAL NOT NULL'
+            ')'
+        )
+        self.conn.commit()
+        self.entries = {
+            chat_key: (peer_type, peer_id, access_hash)
+            for chat_key, peer_type, peer_id, access_hash in self.conn.execute(
+                'SELECT chat_key, peer_type, peer_id, access_hash FROM entity_cache'
+            )
+        }
+
+    def get(self, chat):
+        """获取缓存的InputPeer，没有记录时返回None"""
+        entry = self.entries.get(str(chat))
+        return load_peer(*entry) if entry else None
+
+    def put(self, chat, peer):
+        """保存InputPeer，内容没有变化时不写数据库"""
+        entry = dump_peer(peer)
+        if entry is None or self.entries.get(str(chat)) == entry:
+            return
+        self.entries[str(chat)] = entry
+        try:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO entity_cache '
+                    '(chat_key, peer_type, peer_id, access_hash, updated_at) VALUES (?, ?, ?, ?, ?)',
+                    (str(chat), *entry, time.time())
+                )
+        except sqlite3.Error as e:
+            logger.error(f"保存实体缓存失败: {e}")
+
+    def delete(self, chat):
+        """删除失效的缓存项"""
+        if self.entries.pop(str(chat), None) is None:
+            return
+        try:
+            with self.conn:
+                self.conn.execute('DELETE FROM entity_cache WHERE chat_key = ?', (str(chat),))
+        except sqlite3.Error as e:
+            logger.error(f"删除实体缓存失败: {e}")
+
+    def close(self):
+        """关闭数据库"""
+        self.conn.close()
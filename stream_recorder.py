@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+消息流录制 - 把实时收到的新消息和抓取到的历史消息按收到的时间写入紧凑的JSON Lines文件
+(文件名以 .gz 结尾时压缩)，之后可以用 benchmark.py --replay 离线重放
+"""
+
+import gzip
+import json
+import logging
+import os
+import time
+
+from message_info import classify
+
+logger = logging.getLogger(__name__)
+
+
+def open_recording(path, mode):
+    """按扩展名打开普通或gzip压缩的录制文件"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def describe_message(message, info=None):
+    """提取重放需要的字段，值为空的字段省略；info 为已有的分类结果 (没有时在这里分类)"""
+    if info is None:
+        info = classify(message)
+    record = {
+        'id': message.id,
+        'date': message.date.timestamp() if message.date else None,
+        'text': info.text,
+        'reply_to': info.reply_to,
+        'grouped_id': info.grouped_id,
+    }
+    if info.kind == 'service':
+        record['service'] = True
+    elif info.has_media:
+        media = {
+            'kind': info.kind,
+            'id': getattr(info.file, 'id', None),
+            'size': info.size,
+            'mime': info.mime,
+            'name': info.file_name,
+        }
+        record['media'] = {key: value for key, value in media.items() if value is not None}
+    return {key: value for key, value in record.items() if value is not None}
+
+
+class StreamRecorder:
+    """追加写入的消息流录制器
+
+    每行一条记录: {"t": 收到的时间, "src": 来源, "chat": 源ID, "id": ..., "date": ..., ...}，
+    来源为 live (实时新消息)、catch_up (补齐缺口时抓取) 或 history (历史同步时抓取)。
+    写入先缓冲在内存中，攒满 batch_size 条或关闭时一次写入。
+    """
+
+    def __init__(self, path, batch_size=100):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+        self.count = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self, source, chat_id, message):
+        """记录一条消息"""
+        try:
+            entry = {'t': round(time.time(), 3), 'src': source, 'chat': chat_id}
+            entry.update(describe_message(message))
+        except Exception as e:
+            logger.warning(f"录制消息失败: {e}")
+            return
+        self.buffer.append(json.dumps(entry, ensure_ascii=False, separators=(',', ':')))
+        self.count += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """把缓冲的记录写入文件"""
+        if not self.buffer:
+            return
+        try:
+            with open_recording(self.path, 'a') as f:
+                f.write('\n'.join(self.buffer) + '\n')
+        except OSError as e:
+            logger.error(f"写入录制文件失败: {e}")
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        logger.info(f"消息流录制已保存: {self.path} (本次 {self.count} 条)")
+
+
+def load_recording(path):
+    """按写入顺序读取录制文件中的所有记录"""
+    records = []
+    with open_recording(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
@@ -6,12 +6,31 @@ Telegram消息同步工具
 
 import asyncio
 import logging
-from telethon import TelegramClient, events
+from telethon import TelegramClient, events, utils
 from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
 import json
 import os
+import re
+import signal
 from datetime import datetime, timedelta
 import time
+from telethon.errors import FileReferenceExpiredError, FloodWaitError, MessageNotModifiedError, ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError
+from state_store import MessageMappingStore, CheckpointStore, EntityCacheStore, MAPPING_ALIAS, MAPPING_TIMESTAMP
+from rate_limiter import AdaptiveRateLimiter
+from client_pool import ClientPool
+from album_collector import AlbumCollector, MAX_ALBUM_SIZE
+from change_batcher import EditCoalescer, DeleteBatcher
+from message_filter import FilterEngine
+from routing import RouteTable, parse_chat_id
+from dedup import DuplicateIndex
+from message_info import classify
+from media_cache import MediaCache, source_media_key, hash_file
+from metrics import MetricsRegistry
+from metrics_server import MetricsServer
+from send_queue import SendQueue
+from stream_recorder import StreamRecorder
+from archive import MessageArchive
+from search_index import SearchIndex
 
 # 配置日志
 logging.basicConfig(
@@ -20,15 +39,89 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 表示缓存的实体已失效 (access_hash过期等)，需要重新解析
+PEER_ERRORS = (ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError)
+
+# 重新加载配置时不会生效、需要重启的配置项
+RESTART_KEYS = ('api_id', 'api_hash', 'phone', 'state', 'rate_limit', 'sender_pool',
+                'send_queue', 'media_cache', 'metrics', 'record', 'archive', 'search', 'catch_up', 'config_reload')
+
 class TelegramSyncer:
     def __init__(self, config_file='config.json'):
+        self.filter_engine = None  # 预编译的过滤规则
+        self.route_table = None  # 源ID -> 目标频道路由
+        self.config_file = config_file  # 重新加载时读取的配置文件
+        self.config_mtime = None  # 上次读取时配置文件的修改时间
         self.config = self.load_config(config_file)
         self.client = None
-        self.message_mapping = {}  # 用于映射原消息ID到新消息ID
+        self.message_mapping = None  # (源ID, 原消息ID) -> 新消息ID 的持久化映射
+        self.checkpoints = None  # 每个源已处理的最大消息ID
+        self.rate_limiter = None  # 主账号发送请求的限速器
+        self.sender_pool = None  # 分担发送请求的账号池
+        self.album_collector = None  # 实时消息的相册收集器
+        self.send_queue = None  # 实时消息的发送队列
+        self.edit_coalescer = None  # 合并源消息的连续编辑
+        self.delete_batcher = None  # 攒批源消息的删除
+        self.metrics = MetricsRegistry()  # 转发/过滤/失败计数和发送耗时
+        self.last_event_time = {}  # 每个源最近一次收到新消息的时间
+        self.held_messages = {}  # 正在补齐缺口的源 -> 补齐期间收到的实时消息
+        self.history_queue = None  # 正在进行的历史同步队列
+        self.input_peers = {}  # 聊天ID -> 已解析的InputPeer
+        self.entity_cache = None  # 跨重启保留的InputPeer缓存
+        self.media_cache = None  # 已上传媒体的引用索引和本地暂存目录
+        self.dedup_index = None  # 重复内容指纹索引，未启用时为None
+        self.recorder = None  # 消息流录制器，未启用时为None
+        self.archive = None  # 已同步消息的本地归档，未启用时为None
+        self.search_index = None  # 已同步消息的全文索引，未启用时为None
+        self.event_handlers = []  # 已注册的 (处理函数, 事件构造器)
+        self.reload_lock = asyncio.Lock()  # 同一时间只进行一次配置重新加载
+        self.background_tasks = set()  # 重新加载和新源的历史同步等后台任务
+        if self.config:
+            self.message_mapping = self.open_mapping_store()
+            self.checkpoints = self.open_checkpoint_store()
+            self.entity_cache = EntityCacheStore(self.config.get('state', {}).get('db_path', 'sync_state.db'))
+            self.media_cache = self.open_media_cache()
+            dedup_config = dict(self.config.get('dedup', {}))
+            if dedup_config.pop('enabled', False):
+                self.dedup_index = DuplicateIndex(**dedup_config)
+            self.rate_limiter = AdaptiveRateLimiter(**self.config.get('rate_limit', {}))
+            pool_config = self.config.get('sender_pool', {})
+            self.sender_pool = ClientPool(
+                include_main=pool_config.get('include_main', True),
+                upload_media=pool_config.get('upload_media', False)
+            )
+            self.album_collector = AlbumCollector(self.enqueue_album, self.config.get('album_window', 0.5))
+            self.send_queue = self.create_send_queue()
+            propagate_config = self.config.get('propagate', {})
+            self.edit_coalescer = EditCoalescer(self.apply_edit, propagate_config.get('edit_delay', 2))
+            self.delete_batcher = DeleteBatcher(self.apply_deletes, propagate_config.get('delete_delay', 1))
+            record_config = self.config.get('record', {})
+            if record_config.get('enabled', False):
+                self.recorder = StreamRecorder(record_config.get('path', 'recordings/stream.jsonl.gz'))
+            archive_config = dict(self.config.get('archive', {}))
+            if archive_config.pop('enabled', False):
+                self.archive = MessageArchive(**archive_config)
+            search_config = dict(self.config.get('search', {}))
+            if search_config.pop('enabled', False):
+                self.search_index = SearchIndex(**search_config)
+            self.register_gauges()
         
     def load_config(self, config_file):
         """加载配置文件"""
+        self.config_file = config_file
+        loaded = self.read_config(config_file)
+        if loaded is None:
+            return None
+        config, self.filter_engine, self.route_table = loaded
+        return config
+    
+    def read_config(self, config_file):
+        """读取配置并预编译过滤规则和路由表，返回 (配置, 过滤规则, 路由表)
+
+        出错时记录日志并返回None，不修改当前使用的配置，重新加载失败时可以继续运行。
+        """
         try:
+            self.config_mtime = os.stat(config_file).st_mtime_ns
             with open(config_file, 'r', encoding='utf-8') as f:
                 config = json.load(f)
                 
@@ -40,14 +133,127 @@ class TelegramSyncer:
                     clean_chat_id = str(chat_id).strip()
                     source_chats[int(clean_chat_id)] = name
                 config['source_chats'] = source_chats
+            
+            # 预编译过滤规则，避免每条消息重复处理关键词
+            filter_engine = FilterEngine(config.get('filters'))
+            route_table = RouteTable(
+                config.get('source_chats', {}), config.get('routes'), config.get('target_channel')
+            )
                 
-            return config
+            return config, filter_engine, route_table
         except FileNotFoundError:
             logger.error(f"配置文件 {config_file} 不存在")
             return None
         except json.JSONDecodeError as e:
             logger.error(f"配置文件格式错误: {e}")
             return None
+        except re.error as e:
+            logger.error(f"过滤规则中的正则表达式无效: {e}")
+            return None
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f"配置内容无效: {e}")
+            return None
+    
+    def open_mapping_store(self):
+        """打开消息ID映射存储"""
+        state_config = self.config.get('state', {})
+        return MessageMappingStore(
+            db_path=state_config.get('db_path', 'sync_state.db'),
+            cache_size=state_config.get('mapping_cache_size', 10000),
+            batch_size=state_config.get('batch_size', 100),
+            flush_interval=state_config.get('flush_interval', 5),
+            default_target=parse_chat_id(self.config.get('target_channel'))
+        )
+    
+    def open_checkpoint_store(self):
+        """打开历史同步断点存储"""
+        state_config = self.config.get('state', {})
+        return CheckpointStore(
+            db_path=state_config.get('db_path', 'sync_state.db'),
+            batch_size=state_config.get('checkpoint_batch', 20),
+            flush_interval=state_config.get('flush_interval', 5),
+            before_flush=self.message_mapping.flush
+        )
+    
+    def open_media_cache(self):
+        """打开媒体缓存"""
+        media_config = self.config.get('media_cache', {})
+        return MediaCache(
+            db_path=self.config.get('state', {}).get('db_path', 'sync_state.db'),
+            spool_dir=media_config.get('spool_dir', 'media_spool'),
+            spool_size=media_config.get('spool_size', 1024 * 1024 * 1024)
+        )
+    
+    def close(self):
+        """保存未提交的状态"""
+        if self.checkpoints:
+            self.checkpoints.close()
+            self.checkpoints = None
+        if self.message_mapping:
+            self.message_mapping.close()
+            self.message_mapping = None
+        if self.entity_cache:
+            self.entity_cache.close()
+            self.entity_cache = None
+        if self.media_cache:
+            self.media_cache.close()
+            self.media_cache = None
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+        if self.archive:
+            self.archive.close()
+            self.archive = None
+        if self.search_index:
+            self.search_index.close()
+            self.search_index = None
+    
+    def create_send_queue(self):
+        """创建实时消息发送队列"""
+        queue_config = self.config.get('send_queue', {})
+        return SendQueue(
+            self.deliver_live,
+            workers=queue_config.get('workers', 4),
+            media_workers=queue_config.get('media_workers', 2),
+            max_size=queue_config.get('max_size', 1000),
+            large_file_size=queue_config.get('large_file_size', 10 * 1024 * 1024)
+        )
+    
+    def register_gauges(self):
+        """注册导出时读取的瞬时指标和由其他组件累计的计数"""
+        self.metrics.gauge('history_queue_depth', lambda: self.history_queue.qsize() if self.history_queue else 0)
+        self.metrics.gauge('send_queue_depth', lambda: self.send_queue.depth())
+        self.metrics.gauge('album_pending_messages', lambda: self.album_collector.pending())
+        self.metrics.counter('flood_wait_seconds', lambda: self.sender_pool.flood_wait_seconds())
+        self.metrics.gauge('send_rate', lambda: self.sender_pool.rates())
+        self.metrics.gauge('media_spool_bytes', lambda: self.media_cache.spool_bytes() if self.media_cache else 0)
+        self.metrics.gauge('mapping_store_size', lambda: self.message_mapping.count() if self.message_mapping else 0)
+        self.metrics.gauge('last_event_timestamp_seconds', lambda: [
+            ({'source': source_chat_id}, event_time) for source_chat_id, event_time in self.last_event_time.items()
+        ])
+    
+    def health(self):
+        """健康检查: 客户端是否在线以及各源距上次新消息的秒数"""
+        connected = bool(self.client and self.transport_connected())
+        now = time.time()
+        return {
+            'status': 'ok' if connected else 'disconnected',
+            'connected': connected,
+            'seconds_since_last_event': {
+                str(source_chat_id): round(now - event_time, 1)
+                for source_chat_id, event_time in self.last_event_time.items()
+            }
+        }
+    
+    def observe_forward_latency(self, source_chat_id, message_date):
+        """记录端到端延迟: 源消息时间到发送完成"""
+        if message_date:
+            self.metrics.observe('forward_latency_seconds', time.time() - message_date.timestamp(), source=source_chat_id)
+    
+    def attach_client(self, client):
+        """使用已经登录的客户端作为主账号 (也用于基准测试中的模拟客户端)"""
+        self.client = client
+        self.sender_pool.add('main', client, self.rate_limiter, main=True)
     
     async def initialize_client(self):
         """初始化Telegram客户端"""
@@ -55,12 +261,358 @@ class TelegramSyncer:
         api_hash = self.config['api_hash']
         phone = self.config['phone']
         
-        self.client = TelegramClient('session', api_id, api_hash)
-        await self.client.start(phone=phone)
+        # flood_sleep_threshold=0: FloodWait不在Telethon内部静默等待，交给限速器调整速率
+        client = TelegramClient('session', api_id, api_hash, flood_sleep_threshold=0)
+        await client.start(phone=phone)
+        self.attach_client(client)
         logger.info("Telegram客户端初始化成功")
+        
+        # 额外的发送账号，每个账号有独立的会话文件和限速器
+        for account in self.config.get('sender_pool', {}).get('accounts', []):
+            session = account['session']
+            try:
+                client = TelegramClient(
+                    session, account.get('api_id', api_id), account.get('api_hash', api_hash), flood_sleep_threshold=0
+                )
+                if account.get('bot_token'):
+                    await client.start(bot_token=account['bot_token'])
+                else:
+                    await client.start(phone=account['phone'])
+            except Exception as e:
+                logger.error(f"发送账号 {session} 初始化失败: {e}")
+                continue
+            self.sender_pool.add(session, client, AdaptiveRateLimiter(**self.config.get('rate_limit', {})))
+            logger.info(f"发送账号 {session} 初始化成功")
+    
+    async def read_messages(self, *args, **kwargs):
+        """主账号读取消息 (不经过发送限速器)，FloodWait时等待后重试"""
+        while True:
+            try:
+                return await self.client.get_messages(*args, **kwargs)
+            except FloodWaitError as e:
+                logger.warning(f"读取消息触发FloodWait，等待 {e.seconds} 秒后重试")
+                await asyncio.sleep(e.seconds)
     
-    async def sync_single_message(self, message, source_chat_id, target_channel, add_timestamp=False):
-        """同步单条消息到目标频道"""
+    async def iter_history(self, peer, limit=None, offset_date=None, min_id=0):
+        """从旧到新读取消息，FloodWait时等待后从已读取的最后一条之后继续"""
+        fetched = 0
+        while True:
+            try:
+                async for message in self.client.iter_messages(
+                    peer,
+                    limit=None if limit is None else limit - fetched,
+                    offset_date=offset_date,
+                    min_id=min_id,
+                    reverse=True
+                ):
+                    min_id = message.id
+                    fetched += 1
+                    yield message
+                return
+            except FloodWaitError as e:
+                logger.warning(f"读取历史消息触发FloodWait，等待 {e.seconds} 秒后继续")
+                await asyncio.sleep(e.seconds)
+    
+    async def call_with_peer(self, method, chat, *args, main_only=False, **kwargs):
+        """从账号池选择发送账号，把聊天ID换成该账号的InputPeer后经过它的限速器调用
+
+        引用源消息的请求 (原生转发、按引用发送媒体) 只由主账号发送。
+        还有其他账号可用时，FloodWait直接换账号重发，否则由限速器等待后重试。
+        实体失效时刷新缓存并重试一次。
+        """
+        from_peer = kwargs.get('from_peer')
+        main_only = main_only or from_peer is not None
+        flooded = set()
+        refreshed = False
+        while True:
+            sender = self.sender_pool.pick(main_only, chat, flooded)
+            peer = await self.get_sender_peer(sender, chat)
+            if peer is None:
+                # 该账号无法访问目标，已被标记，重新选择
+                continue
+            if from_peer is not None:
+                kwargs['from_peer'] = self.input_peers.get(from_peer, from_peer)
+            spread = not main_only and bool(self.sender_pool.candidates(chat, flooded | {sender}))
+            func = getattr(sender.client, method)
+            sender.pending += 1
+            try:
+                if spread:
+                    return await sender.limiter.call_once(func, peer, *args, **kwargs)
+                return await sender.limiter.call(func, peer, *args, **kwargs)
+            except FloodWaitError as e:
+                if not spread:
+                    raise
+                logger.warning(f"发送账号 {sender.name} 触发FloodWait ({e.seconds} 秒)，改用其他账号发送")
+                flooded.add(sender)
+            except PEER_ERRORS as e:
+                if refreshed:
+                    raise
+                refreshed = True
+                logger.warning(f"缓存的实体已失效: {e}，重新解析后重试")
+                if sender.main:
+                    if not await self.refresh_peers(chat, from_peer):
+                        raise
+                else:
+                    sender.peers.pop(chat, None)
+                    self.entity_cache.delete(f"{sender.name}:{chat}")
+            finally:
+                sender.pending -= 1
+    
+    async def get_sender_peer(self, sender, chat):
+        """获取某个发送账号的目标InputPeer，该账号无法访问时返回None"""
+        if sender.main:
+            return self.input_peers.get(chat, chat)
+        peer = sender.peers.get(chat)
+        if peer is not None:
+            return peer
+        if chat in sender.unreachable:
+            return None
+        key = f"{sender.name}:{chat}"
+        peer = self.entity_cache.get(key)
+        if peer is None:
+            try:
+                peer = await sender.client.get_input_entity(chat)
+            except Exception as e:
+                logger.error(f"发送账号 {sender.name} 无法访问 {chat}: {e}，不会再用它发送到该目标")
+                sender.unreachable.add(chat)
+                return None
+            self.entity_cache.put(key, peer)
+        sender.peers[chat] = peer
+        return peer
+    
+    async def send_message(self, chat, *args, **kwargs):
+        """经过限速器发送文本消息"""
+        return await self.call_with_peer('send_message', chat, *args, **kwargs)
+    
+    async def send_file(self, chat, *args, **kwargs):
+        """经过限速器发送文件"""
+        return await self.call_with_peer('send_file', chat, *args, **kwargs)
+    
+    async def forward_messages(self, chat, *args, **kwargs):
+        """经过限速器原生转发消息"""
+        return await self.call_with_peer('forward_messages', chat, *args, **kwargs)
+    
+    def get_target_id(self, target_channel):
+        """转换目标频道ID为整数（如果是字符串格式）"""
+        return parse_chat_id(target_channel)
+    
+    async def forward_batch(self, source_chat_id, messages):
+        """把一批同源消息原生转发到该源的所有目标，推进断点并清空批次，返回转发成功的条数
+
+        断点只越过已转发、按规则跳过和之前已经转发过的消息；转发失败的消息登记为未完成，
+        断点停在它们之前，下次历史同步或补齐时重新转发 (已有映射的目标跳过)。
+        """
+        if not messages:
+            return 0
+        
+        routes = self.route_table.for_source(source_chat_id)
+        infos = fingerprints = None
+        if self.dedup_index is not None or any(route.filter for route in routes):
+            infos = [classify(m) for m in messages]
+            fingerprints = [self.claim_fingerprint([m], source_chat_id, info) for m, info in zip(messages, infos)]
+        
+        forwarded = 0
+        failed = set()
+        flood_wait = None
+        for route in routes:
+            target_id = self.get_target_id(route.target)
+            remaining = range(len(messages))
+            route_forwarded = 0
+            while remaining:
+                batch = []
+                indexes = []
+                claimed = set()
+                later = []
+                for index in remaining:
+                    message = messages[index]
+                    if self.message_mapping.get(source_chat_id, message.id, target_id):
+                        continue
+                    if infos is not None:
+                        if not route.accepts(infos[index]):
+                            continue
+                        # 与本批中前面的消息内容相同: 等这一批转发结束后再处理，不能在这里等待自己
+                        if fingerprints[index] in claimed:
+                            later.append(index)
+                            continue
+                        if not await self.first_delivery(
+                                [message], source_chat_id, route.target, fingerprints[index], infos[index]):
+                            continue
+                        if fingerprints[index] is not None:
+                            claimed.add(fingerprints[index])
+                    batch.append(message)
+                    indexes.append(index)
+                try:
+                    done = set(await self.forward_to_target(source_chat_id, batch, route.target))
+                except FloodWaitError as e:
+                    flood_wait, done = e, set()
+                    # 该目标正在限流，留到下一轮的消息也一起延后重试
+                    failed.update(messages[index].id for index in later)
+                    later = []
+                route_forwarded += len(done)
+                for message, index in zip(batch, indexes):
+                    if message.id not in done:
+                        failed.add(message.id)
+                    if fingerprints is not None:
+                        self.finish_delivery(fingerprints[index], route.target, message.id in done)
+                remaining = later
+            forwarded = max(forwarded, route_forwarded)
+        if forwarded:
+            self.store_synced(source_chat_id, messages, infos)
+        
+        if failed:
+            if flood_wait is not None:
+                self.defer(source_chat_id, [m for m in messages if m.id in failed], flood_wait)
+            else:
+                self.checkpoints.hold(source_chat_id, failed)
+        completed = [m.id for m in messages if m.id not in failed]
+        if completed:
+            self.checkpoints.complete(source_chat_id, completed)
+        messages.clear()
+        return forwarded
+    
+    async def forward_to_target(self, source_chat_id, messages, target_channel):
+        """原生转发一批同源消息到一个目标 (一次请求最多100条)，返回成功转发的源消息ID
+
+        重试后仍然FloodWait时抛出 FloodWaitError，其他错误记录后视为全部失败。
+        """
+        if not messages:
+            return []
+        
+        target_id = self.get_target_id(target_channel)
+        forwarded = []
+        started = time.monotonic()
+        try:
+            sent_messages = await self.forward_messages(
+                target_id,
+                [message.id for message in messages],
+                from_peer=source_chat_id
+            )
+            for message, sent_message in zip(messages, sent_messages):
+                if sent_message:
+                    self.message_mapping.put(source_chat_id, message.id, target_id, sent_message.id)
+                    forwarded.append(message.id)
+            self.record_sent(source_chat_id, 'forward', started, len(forwarded))
+            logger.debug("✅ 批量转发成功: %d/%d 条", len(forwarded), len(messages))
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ 批量转发失败: {e}")
+        if len(forwarded) < len(messages):
+            self.metrics.inc('messages_failed', len(messages) - len(forwarded), source=source_chat_id, kind='forward')
+        return forwarded
+    
+    async def send_media(self, message, source_chat_id, target_id, file_to_send, content, reply_to_msg_id):
+        """按文件引用复用已有媒体发送；引用过期时重新获取消息，仍失败时下载后重新上传
+
+        文件引用只对主账号有效；开启 sender_pool.upload_media 且其他账号更空闲时，
+        直接下载后由那个账号重新上传。
+        """
+        if self.sender_pool.upload_media and not self.sender_pool.pick(chat=target_id).main:
+            return await self.reupload_media(message, target_id, content, reply_to_msg_id)
+        try:
+            return await self.send_file(
+                target_id,
+                file_to_send,
+                caption=content if content else None,
+                reply_to=reply_to_msg_id,
+                main_only=True
+            )
+        except FileReferenceExpiredError:
+            logger.info("文件引用已过期，重新获取消息")
+            try:
+                refreshed = await self.client.get_messages(self.input_peers.get(source_chat_id, source_chat_id), ids=message.id)
+                if refreshed and refreshed.media:
+                    return await self.send_file(
+                        target_id,
+                        refreshed.media,
+                        caption=content if content else None,
+                        reply_to=reply_to_msg_id,
+                        main_only=True
+                    )
+            except FloodWaitError:
+                raise
+            except Exception as refresh_error:
+                logger.warning(f"重新获取文件引用后发送失败: {refresh_error}")
+        except FloodWaitError:
+            raise
+        except Exception as file_error:
+            logger.warning(f"按引用发送文件失败: {file_error}，尝试下载后重新上传")
+        
+        return await self.reupload_media(message, target_id, content, reply_to_msg_id)
+    
+    async def reupload_media(self, message, target_id, content, reply_to_msg_id):
+        """下载媒体后重新上传
+
+        同一文件 (相同的源文档ID或相同内容) 上传过一次后，之后直接按引用发送已上传的媒体；
+        下载的文件保存在暂存目录中，同一文件同时只下载一次。
+        """
+        media_key = source_media_key(message)
+        sent_message = await self.send_cached_media(media_key, target_id, content, reply_to_msg_id)
+        if sent_message:
+            return sent_message
+        
+        async with self.media_cache.spool(media_key) as spool_dir:
+            path = self.media_cache.spooled_file(spool_dir)
+            if path is None:
+                path = await self.client.download_media(message, file=spool_dir + os.sep)
+                if not path:
+                    raise ValueError("无法下载媒体文件")
+                self.metrics.inc('media_downloads')
+            
+            # 不同文档ID的相同文件 (重新上传的转载) 按内容哈希识别
+            content_key = f"sha256:{await asyncio.to_thread(hash_file, path)}"
+            sent_message = await self.send_cached_media(content_key, target_id, content, reply_to_msg_id)
+            if sent_message:
+                self.media_cache.put([media_key], sent_message, target_id)
+                return sent_message
+            
+            attributes = getattr(message.document, 'attributes', None) if getattr(message, 'document', None) else None
+            sent_message = await self.send_file(
+                target_id,
+                path,
+                caption=content if content else None,
+                reply_to=reply_to_msg_id,
+                attributes=attributes
+            )
+            self.metrics.inc('media_uploads')
+            self.media_cache.put([media_key, content_key], sent_message, target_id)
+            return sent_message
+    
+    async def send_cached_media(self, cache_key, target_id, content, reply_to_msg_id):
+        """按引用发送已经上传过的媒体，没有缓存或引用不可用时返回None"""
+        cached = self.media_cache.get(cache_key)
+        if cached is None:
+            return None
+        media, cached_chat, cached_msg_id = cached
+        try:
+            try:
+                sent_message = await self.send_file(
+                    target_id, media, caption=content if content else None, reply_to=reply_to_msg_id
+                )
+            except FileReferenceExpiredError:
+                # 从当初上传到的目标消息重新获取文件引用
+                chat = parse_chat_id(cached_chat)
+                refreshed = await self.client.get_messages(self.input_peers.get(chat, chat), ids=cached_msg_id)
+                if not refreshed or not refreshed.media:
+                    raise
+                self.media_cache.put([cache_key], refreshed, chat)
+                sent_message = await self.send_file(
+                    target_id, refreshed.media, caption=content if content else None, reply_to=reply_to_msg_id
+                )
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            logger.warning(f"按引用发送已上传的媒体失败: {e}，重新上传")
+            self.media_cache.delete(cache_key)
+            return None
+        self.metrics.inc('media_cache_hits')
+        return sent_message
+    
+    async def sync_single_message(self, message, source_chat_id, target_channel, add_timestamp=False, info=None):
+        """同步单条消息到一个目标频道 (info 为已有的消息分类结果，没有时在这里分类)
+
+        重试后仍然FloodWait时抛出 FloodWaitError，其他错误记录后返回False。
+        """
         try:
             # 检查是否是需要同步的源
             if source_chat_id not in self.config['source_chats']:
@@ -68,357 +620,886 @@ class TelegramSyncer:
             
             source_name = self.config['source_chats'][source_chat_id]
             
+            if info is None:
+                info = classify(message)
+            
             # 应用过滤器
-            if not self.should_sync_message(message):
+            if not self.should_sync_message(message, source_chat_id, info):
                 return False
             
-            # 转换目标频道ID为整数（如果是字符串格式）
-            if isinstance(target_channel, str) and target_channel.startswith('-'):
-                target_id = int(target_channel)
-            else:
-                target_id = target_channel
+            # 原生转发模式: 保留原作者信息，不重新上传媒体
+            if self.config.get('forward_mode', 'copy') == 'forward':
+                return bool(await self.forward_to_target(source_chat_id, [message], target_channel))
             
-            # 构建消息内容
-            content = ""
+            target_id = self.get_target_id(target_channel)
             
-            if message.text:
-                content = message.text
+            # 构建消息内容
+            content = info.text or ""
             
             # 处理回复消息
-            reply_to_msg_id = None
-            if message.reply_to and hasattr(message.reply_to, 'reply_to_msg_id'):
-                original_reply_id = message.reply_to.reply_to_msg_id
-                # 查找映射的消息ID
-                reply_to_msg_id = self.message_mapping.get(original_reply_id)
-                if reply_to_msg_id:
-                    logger.info(f"找到回复目标: 原消息ID {original_reply_id} -> 新消息ID {reply_to_msg_id}")
-                else:
-                    logger.warning(f"未找到回复目标消息ID {original_reply_id}，将作为普通消息发送")
+            reply_to_msg_id = self.resolve_reply(info, source_chat_id, target_id)
             
             # 添加来源和时间信息
-            footer = []
-            if self.config.get('add_source_info', True):
-                footer.append(f"📢 来源: {source_name}")
-            if add_timestamp and message.date:
-                footer.append(f"🕐 时间: {message.date.strftime('%Y-%m-%d %H:%M:%S')}")
-            
+            footer = self.build_footer(message, source_name, add_timestamp)
             if footer:
-                content += f"\n\n{' | '.join(footer)}"
+                content += f"\n\n{footer}"
             
             # 发送消息 - 优先处理所有类型的文件
             sent_message = None
             
-            # 检查是否有任何类型的媒体文件
-            has_file = False
-            file_to_send = None
-            
-            # 按优先级检查文件类型 - 使用安全的属性访问
-            if getattr(message, 'document', None):
-                file_to_send = message.document
-                has_file = True
-                mime_type = getattr(message.document, 'mime_type', 'unknown')
-                logger.info(f"检测到文档: {mime_type}")
-            elif getattr(message, 'photo', None):
-                file_to_send = message.photo
-                has_file = True
-                logger.info("检测到图片")
-            elif getattr(message, 'video', None):
-                file_to_send = message.video
-                has_file = True
-                logger.info("检测到视频")
-            elif getattr(message, 'audio', None):
-                file_to_send = message.audio
-                has_file = True
-                logger.info("检测到音频")
-            elif getattr(message, 'voice', None):
-                file_to_send = message.voice
-                has_file = True
-                logger.info("检测到语音")
-            elif getattr(message, 'video_note', None):
-                file_to_send = message.video_note
-                has_file = True
-                logger.info("检测到视频消息")
-            elif getattr(message, 'sticker', None):
-                file_to_send = message.sticker
-                has_file = True
-                logger.info("检测到贴纸")
-            elif getattr(message, 'animation', None):
-                file_to_send = message.animation
-                has_file = True
-                logger.info("检测到动画/GIF")
-            elif getattr(message, 'media', None):
-                file_to_send = message.media
-                has_file = True
-                logger.info(f"检测到其他媒体: {type(message.media)}")
+            # 媒体文件在分类时已经确定
+            file_to_send = info.file
+            started = time.monotonic()
             
             # 发送文件或文本
-            if has_file and file_to_send:
+            if file_to_send is not None:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("检测到%s", info.describe())
                 try:
-                    sent_message = await self.client.send_file(
+                    sent_message = await self.send_media(
+                        message,
+                        source_chat_id,
                         target_id,
                         file_to_send,
-                        caption=content if content else None,
-                        reply_to=reply_to_msg_id
+                        content,
+                        reply_to_msg_id
                     )
-                    logger.info("✅ 文件发送成功")
+                    logger.debug("✅ 文件发送成功")
+                except FloodWaitError:
+                    raise
                 except Exception as file_error:
-                    logger.error(f"❌ 文件发送失败: {file_error}")
+                    logger.error(f"❌ 文件发送失败，该文件未能同步: {file_error}")
                     # 如果文件发送失败，尝试只发送文本
                     if content:
-                        sent_message = await self.client.send_message(
+                        sent_message = await self.send_message(
                             target_id,
                             content,
                             reply_to=reply_to_msg_id
                         )
-                        logger.info("✅ 文本发送成功（文件发送失败后的备选）")
+                        logger.debug("✅ 文本发送成功（文件发送失败后的备选）")
             elif content:
                 # 发送纯文本
-                sent_message = await self.client.send_message(
+                sent_message = await self.send_message(
                     target_id,
                     content,
                     reply_to=reply_to_msg_id
                 )
-                logger.info("✅ 文本消息发送成功")
+                logger.debug("✅ 文本消息发送成功")
             else:
                 logger.warning("❌ 消息既没有文件也没有文本内容")
+                self.metrics.inc('messages_failed', source=source_chat_id, kind=info.kind)
                 return False
             
             # 保存消息ID映射，用于后续回复
             if sent_message:
                 new_msg_id = sent_message.id if hasattr(sent_message, 'id') else sent_message
-                self.message_mapping[message.id] = new_msg_id
-                logger.info(f"保存消息映射: 原ID {message.id} -> 新ID {new_msg_id}")
-                logger.info(f"当前映射表大小: {len(self.message_mapping)}")
+                self.message_mapping.put(
+                    source_chat_id, message.id, target_id, new_msg_id, self.mapping_flags(message, add_timestamp)
+                )
+                logger.debug("保存消息映射: 原ID %s -> 新ID %s", message.id, new_msg_id)
+                self.record_sent(source_chat_id, info.kind, started)
+            else:
+                self.metrics.inc('messages_failed', source=source_chat_id, kind=info.kind)
             
             return True
             
+        except FloodWaitError:
+            # 限速器重试后仍然FloodWait，交给调用方推迟处理，不能当作失败丢弃
+            raise
         except Exception as e:
             logger.error(f"同步消息时出错: {e}")
+            self.metrics.inc('messages_failed', source=source_chat_id, kind=info.kind if info else 'unknown')
             return False
     
-    def should_sync_message(self, message):
-        """检查消息是否应该被同步"""
-        # 跳过系统消息（如用户加入/离开等）
-        if hasattr(message, '__class__') and 'MessageService' in str(message.__class__):
-            logger.info(f"跳过系统消息: {message.__class__.__name__}")
-            return False
-        
-        # 检查消息是否有内容 - 包括所有文件类型
-        has_text = bool(getattr(message, 'text', None))
-        has_media = bool(
-            getattr(message, 'media', None) or 
-            getattr(message, 'document', None) or 
-            getattr(message, 'photo', None) or 
-            getattr(message, 'video', None) or
-            getattr(message, 'audio', None) or 
-            getattr(message, 'voice', None) or 
-            getattr(message, 'video_note', None) or 
-            getattr(message, 'sticker', None) or 
-            getattr(message, 'animation', None)
-        )
-        
-        # 如果既没有文本也没有媒体，但是是回复消息，也要同步（可能是纯文件回复）
-        is_reply = bool(getattr(message, 'reply_to', None))
+    def record_sent(self, source_chat_id, kind, started, count=1):
+        """记录发送成功的条数和耗时"""
+        self.metrics.inc('messages_forwarded', count, source=source_chat_id, kind=kind)
+        self.metrics.observe('send_latency_seconds', time.monotonic() - started, source=source_chat_id, kind=kind)
+    
+    def resolve_reply(self, info, source_chat_id, target_id):
+        """查找被回复消息在目标频道中的ID，找不到时返回None"""
+        original_reply_id = info.reply_to
+        if not original_reply_id:
+            return None
+        # 查找映射的消息ID
+        reply_to_msg_id = self.message_mapping.get(source_chat_id, original_reply_id, target_id)
+        if reply_to_msg_id:
+            logger.debug("找到回复目标: 原消息ID %s -> 新消息ID %s", original_reply_id, reply_to_msg_id)
+        else:
+            logger.debug("未找到回复目标消息ID %s，将作为普通消息发送", original_reply_id)
+            self.metrics.inc('reply_target_missing', source=source_chat_id)
+        return reply_to_msg_id
+    
+    def build_footer(self, message, source_name, add_timestamp):
+        """生成来源和时间信息"""
+        footer = []
+        if self.config.get('add_source_info', True):
+            footer.append(f"📢 来源: {source_name}")
+        if add_timestamp and message.date:
+            footer.append(f"🕐 时间: {message.date.strftime('%Y-%m-%d %H:%M:%S')}")
+        return ' | '.join(footer)
+    
+    @staticmethod
+    def mapping_flags(message, add_timestamp):
+        """映射的标记: 记录发送时是否带有时间，编辑时按同样的格式重新生成来源信息"""
+        return MAPPING_TIMESTAMP if add_timestamp and message.date else 0
+    
+    async def sync_album(self, messages, source_chat_id, target_channel, add_timestamp=False, info=None):
+        """把一个相册 (同一 grouped_id 的多条消息) 作为一次请求发送，返回同步的条数
+
+        info 为带说明文字那条消息的分类结果，没有时在这里分类。
+        """
+        if len(messages) == 1:
+            success = await self.sync_single_message(messages[0], source_chat_id, target_channel, add_timestamp, info)
+            return 1 if success else 0
         
-        if not has_text and not has_media and not is_reply:
-            logger.info(f"跳过空消息: ID {message.id}")
-            return False
+        try:
+            if source_chat_id not in self.config['source_chats']:
+                return 0
+            
+            source_name = self.config['source_chats'][source_chat_id]
+            
+            # 相册的说明文字通常只在其中一条上，以它为准进行过滤
+            lead = next((m for m in messages if getattr(m, 'text', None)), messages[0])
+            if info is None:
+                info = classify(lead)
+            if not self.should_sync_message(lead, source_chat_id, info):
+                return 0
+            
+            if self.config.get('forward_mode', 'copy') == 'forward':
+                return len(await self.forward_to_target(source_chat_id, list(messages), target_channel))
             
-        filters = self.config.get('filters', {})
+            target_id = self.get_target_id(target_channel)
+            replying = next((m for m in messages if m.reply_to), lead)
+            reply_to_msg_id = self.resolve_reply(
+                info if replying is lead else classify(replying), source_chat_id, target_id
+            )
+            
+            # 来源和时间信息只添加一次
+            captions = [m.text or '' for m in messages]
+            footer = self.build_footer(lead, source_name, add_timestamp)
+            if footer:
+                index = messages.index(lead)
+                captions[index] = f"{captions[index]}\n\n{footer}" if captions[index] else footer
+            
+            started = time.monotonic()
+            sent_messages = await self.send_file(
+                target_id,
+                [m.media for m in messages],
+                caption=captions,
+                reply_to=reply_to_msg_id,
+                main_only=True
+            )
+            flags = self.mapping_flags(lead, add_timestamp)
+            for message, sent_message in zip(messages, sent_messages):
+                self.message_mapping.put(source_chat_id, message.id, target_id, sent_message.id, flags)
+            self.record_sent(source_chat_id, 'album', started, len(messages))
+            logger.debug("✅ 相册发送成功: %d 个文件", len(messages))
+            return len(messages)
+            
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ 相册发送失败: {e}，改为逐条发送")
+            synced = 0
+            for message in messages:
+                if await self.sync_single_message(message, source_chat_id, target_channel, add_timestamp):
+                    synced += 1
+            return synced
+    
+    async def deliver(self, messages, source_chat_id, info=None, add_timestamp=False, skip_synced=False):
+        """把一条消息或一个相册同步到源的所有目标频道，返回同步的条数 (各目标中的最大值)
+
+        消息只分类和过滤一次，然后按路由逐个目标发送，每个目标有自己的回复映射。
+        skip_synced 时跳过映射表中已有记录的目标 (补齐的消息和重连后重复收到的更新)。
+        """
+        if len(messages) == 1:
+            lead = messages[0]
+        else:
+            lead = next((m for m in messages if getattr(m, 'text', None)), messages[0])
+            info = None
+        if info is None:
+            info = classify(lead)
+        if not self.should_sync_message(lead, source_chat_id, info):
+            return 0
         
-        # 如果没有设置任何过滤器，同步所有消息
-        if not any(filters.values()):
+        fingerprint = self.claim_fingerprint(messages, source_chat_id, info)
+        synced = 0
+        accepted = False
+        for route in self.route_table.for_source(source_chat_id):
+            if not route.accepts(info):
+                continue
+            accepted = True
+            if skip_synced and self.message_mapping.get(
+                source_chat_id, messages[-1].id, self.get_target_id(route.target)
+            ):
+                continue
+            if not await self.first_delivery(messages, source_chat_id, route.target, fingerprint, info):
+                continue
+            count = 0
+            try:
+                if len(messages) == 1:
+                    count = 1 if await self.sync_single_message(
+                        lead, source_chat_id, route.target, add_timestamp, info
+                    ) else 0
+                else:
+                    count = await self.sync_album(messages, source_chat_id, route.target, add_timestamp, info)
+            finally:
+                self.finish_delivery(fingerprint, route.target, count > 0)
+            synced = max(synced, count)
+        if not accepted:
+            self.metrics.inc('messages_filtered', source=source_chat_id, kind=info.kind)
+        if synced:
+            self.store_synced(source_chat_id, messages, [info if m is lead else None for m in messages])
+        return synced
+    
+    def store_synced(self, source_chat_id, messages, infos=None, edited=False):
+        """把已同步到目标的消息写入本地归档 (连同各目标中的消息ID) 和全文索引
+
+        infos 为各消息已有的分类结果 (缺少的在这里分类)，归档和索引共用同一次分类。
+        """
+        if self.archive is None and self.search_index is None:
+            return
+        source_name = self.config['source_chats'].get(source_chat_id)
+        target_ids = [self.get_target_id(route.target) for route in self.route_table.for_source(source_chat_id)]
+        for index, message in enumerate(messages):
+            targets = {}
+            for target_id in target_ids:
+                entry = self.message_mapping.lookup(source_chat_id, message.id, target_id)
+                if entry and not entry[1] & MAPPING_ALIAS:
+                    targets[target_id] = entry[0]
+            if not targets:
+                continue
+            info = infos[index] if infos else None
+            if info is None:
+                info = classify(message)
+            if self.archive is not None:
+                self.archive.append(source_chat_id, message, source_name, targets, edited, info)
+            if self.search_index is not None:
+                self.search_index.add(source_chat_id, message, info)
+    
+    def claim_fingerprint(self, messages, source_chat_id, info):
+        """计算内容指纹并在去重索引中登记，返回内容相同的已登记指纹 (未启用去重时返回None)"""
+        if self.dedup_index is None:
+            return None
+        date = messages[0].date
+        fingerprint = self.dedup_index.fingerprint(
+            info.text,
+            [source_media_key(m) for m in messages],
+            date.timestamp() if date else time.time(),
+            source_chat_id,
+            [m.id for m in messages]
+        )
+        return self.dedup_index.claim(fingerprint) if fingerprint else None
+    
+    async def first_delivery(self, messages, source_chat_id, target_channel, fingerprint, info):
+        """去重: 内容第一次发往该目标时登记并返回True；已经由其他消息发送过时跳过并返回False
+
+        相同内容正在发往该目标时先等它结束: 发送成功则跳过，失败则改由这条消息发送。
+        返回True后必须调用 finish_delivery。
+        """
+        if fingerprint is None:
             return True
-        
-        # 关键词过滤
-        if filters.get('keywords') and has_text:
-            if not any(keyword.lower() in message.text.lower() for keyword in filters['keywords']):
+        sender = (source_chat_id, tuple(m.id for m in messages))
+        while True:
+            delivered = fingerprint.targets.get(target_channel)
+            if delivered is None or delivered == sender:
+                break
+            sending = fingerprint.sending.get(target_channel)
+            if sending is None:
+                self.skip_duplicate(messages, source_chat_id, target_channel, delivered, info)
                 return False
-        
-        # 排除关键词
-        if filters.get('exclude_keywords') and has_text:
-            if any(keyword.lower() in message.text.lower() for keyword in filters['exclude_keywords']):
-                return False
-        
-        # 媒体类型过滤
-        if filters.get('media_only') and not has_media:
+            await sending.wait()
+        # 发送前就登记，同时处理的相同内容会等待这次发送结束
+        fingerprint.targets[target_channel] = sender
+        fingerprint.sending[target_channel] = asyncio.Event()
+        return True
+    
+    def finish_delivery(self, fingerprint, target_channel, delivered):
+        """发送结束: 失败时撤销 first_delivery 的登记，并唤醒等待这次发送的相同内容"""
+        if fingerprint is None:
+            return
+        if not delivered:
+            fingerprint.targets.pop(target_channel, None)
+        sending = fingerprint.sending.pop(target_channel, None)
+        if sending is not None:
+            sending.set()
+    
+    def skip_duplicate(self, messages, source_chat_id, target_channel, delivered, info):
+        """跳过已经发送到目标的重复内容，并让它指向发送的那条消息在目标中的副本，之后的回复仍能对上
+
+        delivered 为发送这份内容的 (源ID, 消息ID元组)。这样的映射标记为别名，编辑和删除不会作用到那份副本上。
+        """
+        target_id = self.get_target_id(target_channel)
+        original_chat_id, original_ids = delivered
+        if len(original_ids) == len(messages):
+            for message, original_id in zip(messages, original_ids):
+                mapped = self.message_mapping.get(original_chat_id, original_id, target_id)
+                if mapped:
+                    self.message_mapping.put(source_chat_id, message.id, target_id, mapped, MAPPING_ALIAS)
+        self.metrics.inc('messages_duplicate', source=source_chat_id, kind=info.kind)
+        logger.debug(
+            "跳过重复内容: 源 %s 消息 %s 与源 %s 消息 %s 相同",
+            source_chat_id, messages[0].id, original_chat_id, original_ids[0]
+        )
+    
+    def should_sync_message(self, message, source_chat_id=None, info=None):
+        """检查消息是否应该被同步，结果缓存在消息分类 info 上"""
+        if info is None:
+            info = classify(message)
+        if info.allowed is None:
+            info.allowed = self.check_message(message, source_chat_id, info)
+            if not info.allowed:
+                self.metrics.inc('messages_filtered', source=source_chat_id, kind=info.kind)
+        return info.allowed
+    
+    def check_message(self, message, source_chat_id, info):
+        """根据消息分类和过滤规则判断是否同步"""
+        # 跳过系统消息（如用户加入/离开等）
+        if info.kind == 'service':
+            logger.debug("跳过系统消息: %s", message.__class__.__name__)
             return False
         
-        if filters.get('text_only') and has_media:
+        # 如果既没有文本也没有媒体，但是是回复消息，也要同步（可能是纯文件回复）
+        if info.kind == 'empty' and not info.reply_to:
+            logger.debug("跳过空消息: ID %s", message.id)
             return False
         
-        return True
+        # 关键词和媒体类型过滤 (规则在加载配置时已预编译)
+        message_filter = self.filter_engine.for_source(source_chat_id)
+        return message_filter.matches(info.text, info.has_media)
     
     async def sync_message(self, event):
-        """同步新消息到目标频道"""
-        target_channel = self.config['target_channel']
-        success = await self.sync_single_message(
-            event.message, 
-            event.chat_id, 
-            target_channel
+        """收到新消息: 只负责入队，由发送队列的工作协程发送"""
+        if event.chat_id not in self.config['source_chats']:
+            return
+        self.last_event_time[event.chat_id] = time.time()
+        if self.recorder:
+            self.recorder.record('live', event.chat_id, event.message)
+        
+        held = self.held_messages.get(event.chat_id)
+        if held is not None:
+            # 正在补齐该源的缺口，新消息等补齐完成后按顺序处理
+            held.append(event.message)
+            return
+        await self.accept_live(event.chat_id, event.message)
+    
+    async def accept_live(self, source_chat_id, message):
+        """实时消息入队，相册的各个部分先收集起来，凑齐后一起入队
+
+        收集相册期间同一源的其他消息也交给收集器，排在相册后面入队，保持收到的顺序。
+        消息从这里开始登记为未完成，发送完成前断点不会越过它。
+        """
+        self.checkpoints.hold(source_chat_id, [message.id])
+        if getattr(message, 'grouped_id', None) or self.album_collector.holding(source_chat_id):
+            self.album_collector.add(source_chat_id, message)
+            return
+        
+        info = classify(message)
+        await self.send_queue.put(
+            source_chat_id,
+            ([message], info),
+            [message.id],
+            size=info.size or 0,
+            reply_to=info.reply_to
+        )
+    
+    def hold_live_messages(self, source_chat_ids):
+        """开始暂存这些源的实时消息，返回之前没有在补齐中的源"""
+        held = [source_chat_id for source_chat_id in source_chat_ids if source_chat_id not in self.held_messages]
+        for source_chat_id in held:
+            self.held_messages[source_chat_id] = []
+        return held
+    
+    async def catch_up_sources(self, source_chat_ids):
+        """并发补齐多个源的缺口 (调用前需先用 hold_live_messages 暂存它们的实时消息)"""
+        await asyncio.gather(*(self.catch_up(source_chat_id) for source_chat_id in source_chat_ids))
+    
+    async def catch_up(self, source_chat_id):
+        """补齐断线或重启期间错过的消息
+
+        比较断点和源的最新消息ID，只抓取两者之间的消息，按顺序放入发送队列；
+        完成后放行补齐期间暂存的实时消息，已经补齐的部分跳过。
+        从未同步过 (没有断点) 的源由历史同步负责。
+        """
+        source_name = self.config['source_chats'].get(source_chat_id, str(source_chat_id))
+        last_id = self.checkpoints.get(source_chat_id)
+        caught_up = 0
+        try:
+            peer = await self.get_input_peer(source_chat_id) if last_id else None
+            if peer is not None:
+                top = await self.read_messages(peer, limit=1)
+                top_id = top[0].id if top else 0
+                if top_id > last_id:
+                    logger.info(f"{source_name} 有缺口: 断点 {last_id}，最新消息 {top_id}，开始补齐")
+                    album = []
+                    async for message in self.iter_history(peer, min_id=last_id):
+                        if self.recorder:
+                            self.recorder.record('catch_up', source_chat_id, message)
+                        grouped_id = getattr(message, 'grouped_id', None)
+                        if album and (grouped_id != album[0].grouped_id or len(album) >= MAX_ALBUM_SIZE):
+                            await self.enqueue_album(source_chat_id, album)
+                            album = []
+                        if grouped_id:
+                            album.append(message)
+                        else:
+                            await self.accept_live(source_chat_id, message)
+                        last_id = message.id
+                        caught_up += 1
+                    if album:
+                        await self.enqueue_album(source_chat_id, album)
+                    self.metrics.inc('messages_caught_up', caught_up, source=source_chat_id)
+                    logger.info(f"{source_name} 缺口补齐完成: {caught_up} 条消息已放入发送队列")
+        except Exception as e:
+            logger.error(f"补齐 {source_name} 的缺口失败: {e}")
+        finally:
+            held = self.held_messages.pop(source_chat_id, [])
+            for message in held:
+                if message.id > last_id:
+                    await self.accept_live(source_chat_id, message)
+    
+    def transport_connected(self):
+        """客户端与服务器之间的连接当前是否可用
+
+        Telethon 的 is_connected 只表示没有主动断开，自动重连期间仍为True，
+        因此检查发送器底层连接的状态，没有时才退回 is_connected。
+        """
+        check = getattr(getattr(self.client, '_sender', None), '_transport_connected', None)
+        if check is not None:
+            return check()
+        return self.client.is_connected()
+    
+    async def watch_connection(self, interval):
+        """客户端断线重连后补齐断线期间的消息"""
+        connected = True
+        while True:
+            await asyncio.sleep(interval)
+            now_connected = self.transport_connected()
+            if now_connected and not connected:
+                logger.info("客户端已重新连接，开始补齐断线期间的消息")
+                await self.catch_up_sources(self.hold_live_messages(list(self.config['source_chats'])))
+            connected = now_connected
+    
+    async def enqueue_album(self, source_chat_id, messages):
+        """把相册 (或一条消息) 整体入队: 相册收集完成、补齐缺口和推迟的消息重新发送时使用"""
+        self.checkpoints.hold(source_chat_id, [m.id for m in messages])
+        reply_to = next((m.reply_to.reply_to_msg_id for m in messages
+                         if getattr(m.reply_to, 'reply_to_msg_id', None)), None)
+        size = sum(getattr(getattr(m, 'document', None), 'size', 0) or 0 for m in messages)
+        await self.send_queue.put(
+            source_chat_id,
+            (messages, None),
+            [m.id for m in messages],
+            size=size,
+            reply_to=reply_to
         )
-        if success:
-            logger.info(f"新消息已同步到 {target_channel}")
+    
+    async def deliver_live(self, source_chat_id, item):
+        """发送队列的处理函数: 把一条实时消息或一个相册同步到源的所有目标频道
+
+        完成后取消登记，断点推进到该源仍在处理中的最小消息ID之前，而不是这条消息本身。
+        """
+        messages, info = item
+        try:
+            synced = await self.deliver(messages, source_chat_id, info, skip_synced=True)
+        except FloodWaitError as e:
+            self.defer(source_chat_id, messages, e)
+            self.start_background(self.retry_live(source_chat_id, messages, e.seconds))
+            return
+        except Exception:
+            # 其他错误和发送失败一样处理，不让断点一直停在这里
+            self.checkpoints.complete(source_chat_id, [m.id for m in messages])
+            raise
+        self.checkpoints.complete(source_chat_id, [m.id for m in messages])
+        if synced:
+            self.observe_forward_latency(source_chat_id, messages[0].date)
+            logger.debug("新消息已同步: 源 %s 消息 %s", source_chat_id, messages[0].id)
+    
+    def defer(self, source_chat_id, messages, error):
+        """重试后仍然FloodWait的消息: 计入指标，断点停在它们之前，之后重新发送"""
+        self.checkpoints.hold(source_chat_id, [m.id for m in messages])
+        self.metrics.inc('messages_deferred', len(messages), source=source_chat_id)
+        logger.warning(
+            f"源 {source_chat_id} 消息 {messages[0].id} 多次触发FloodWait ({error.seconds} 秒)，推迟发送"
+        )
+    
+    async def retry_live(self, source_chat_id, messages, delay):
+        """FloodWait结束后把推迟的实时消息重新放入发送队列 (已发送到的目标会跳过)"""
+        await asyncio.sleep(delay)
+        await self.enqueue_album(source_chat_id, messages)
+    
+    def sync_edit(self, event):
+        """源消息被编辑: 交给编辑合并器，稍后只同步最终版本"""
+        if event.chat_id not in self.config['source_chats']:
+            return
+        self.edit_coalescer.add(event.chat_id, event.message)
+    
+    def sync_delete(self, event):
+        """源消息被删除: 交给删除攒批器 (只有频道和超级群组的删除事件带有聊天ID)"""
+        if event.chat_id not in self.config['source_chats']:
+            return
+        self.delete_batcher.add(event.chat_id, event.deleted_ids)
+    
+    async def wait_inflight(self, source_chat_id, message_ids):
+        """等待仍在发送队列中的消息发送完成，之后才能查到它们的映射"""
+        for message_id in message_ids:
+            waiting = self.send_queue.inflight.get((source_chat_id, message_id))
+            if waiting is not None:
+                await waiting.wait()
+    
+    async def apply_edit(self, source_chat_id, message):
+        """把源消息的最新文本同步到各目标中对应的消息 (原生转发的消息无法编辑，跳过)"""
+        if self.config.get('forward_mode', 'copy') == 'forward':
+            return
+        await self.wait_inflight(source_chat_id, [message.id])
+        
+        info = classify(message)
+        text = info.text or ""
+        # 相册的来源信息只在带说明文字的那一条上
+        with_footer = bool(text) or not getattr(message, 'grouped_id', None)
+        source_name = self.config['source_chats'].get(source_chat_id, str(source_chat_id))
+        
+        for route in self.route_table.for_source(source_chat_id):
+            target_id = self.get_target_id(route.target)
+            entry = self.message_mapping.lookup(source_chat_id, message.id, target_id)
+            # 别名指向的是另一条源消息的副本，不能被这条消息的编辑覆盖
+            if not entry or entry[1] & MAPPING_ALIAS:
+                continue
+            target_msg_id, flags = entry
+            content = text
+            if with_footer:
+                # 按发送时的格式重新生成来源信息 (历史消息带有时间)
+                footer = self.build_footer(message, source_name, flags & MAPPING_TIMESTAMP)
+                if footer:
+                    content = f"{text}\n\n{footer}" if text else footer
+            try:
+                # 编辑只能由有权限的主账号执行
+                await self.call_with_peer('edit_message', target_id, target_msg_id, content, main_only=True)
+                self.metrics.inc('messages_edited', source=source_chat_id)
+            except MessageNotModifiedError:
+                pass
+            except Exception as e:
+                logger.warning(f"同步编辑失败: 源 {source_chat_id} 消息 {message.id} -> {target_id}: {e}")
+        self.store_synced(source_chat_id, [message], [info], edited=True)
+    
+    async def apply_deletes(self, source_chat_id, message_ids):
+        """在各目标中删除一批源消息对应的消息，每次请求最多100条"""
+        await self.wait_inflight(source_chat_id, message_ids)
+        if self.archive is not None:
+            self.archive.delete(source_chat_id, message_ids)
+        if self.search_index is not None:
+            self.search_index.remove(source_chat_id, message_ids)
+        for route in self.route_table.for_source(source_chat_id):
+            target_id = self.get_target_id(route.target)
+            # 别名指向的是另一条源消息的副本，不随这条消息删除
+            target_msg_ids = [
+                entry[0] for entry in (
+                    self.message_mapping.lookup(source_chat_id, message_id, target_id) for message_id in message_ids
+                ) if entry and not entry[1] & MAPPING_ALIAS
+            ]
+            for start in range(0, len(target_msg_ids), 100):
+                chunk = target_msg_ids[start:start + 100]
+                try:
+                    await self.call_with_peer('delete_messages', target_id, chunk, main_only=True)
+                    self.metrics.inc('messages_deleted', len(chunk), source=source_chat_id)
+                except Exception as e:
+                    logger.warning(f"同步删除失败: 源 {source_chat_id} -> {target_id}: {e}")
     
     async def sync_history(self, source_chat_id, limit=None, days_back=None):
         """同步历史消息"""
+        await self.sync_history_sources([source_chat_id], limit, days_back)
+    
+    async def sync_history_sources(self, source_chat_ids, limit=None, days_back=None):
+        """同步多个源的历史消息
+
+        各源的抓取并发进行 (数量受 history_sync.concurrency 限制)，
+        所有消息经同一个有界队列按源内顺序交给唯一的发送阶段。
+        """
+        if any(target not in self.input_peers for target in self.route_table.targets()):
+            await self.resolve_target_peers()
+        history_config = self.config.get('history_sync', {})
+        
+        # 计算时间范围
+        offset_date = None
+        if days_back:
+            offset_date = datetime.now() - timedelta(days=days_back)
+        
+        # 抓取阶段在后台运行，通过有界队列把消息交给发送阶段
+        queue = self.history_queue = asyncio.Queue(maxsize=history_config.get('queue_size', 100))
+        semaphore = asyncio.Semaphore(history_config.get('concurrency', 4))
+        fetch_tasks = [
+            asyncio.create_task(
+                self.fetch_history(source_chat_id, queue, semaphore, limit, offset_date)
+            )
+            for source_chat_id in source_chat_ids
+        ]
+        
+        # 原生转发模式下每个源单独攒批转发，一次请求最多100条
+        forward_mode = self.config.get('forward_mode', 'copy') == 'forward'
+        forward_batches = {source_chat_id: [] for source_chat_id in source_chat_ids}
+        
+        # 每个源的 [已处理, 已同步] 条数
+        stats = {source_chat_id: [0, 0] for source_chat_id in source_chat_ids}
+        remaining = len(fetch_tasks)
+        processed = 0
+        
+        # 同步消息
         try:
-            target_channel = self.config['target_channel']
-            source_name = self.config['source_chats'].get(source_chat_id, str(source_chat_id))
-            
-            logger.info(f"开始同步 {source_name} 的历史消息...")
-            logger.info(f"源ID: {source_chat_id} (类型: {type(source_chat_id)})")
-            
-            # 确保chat_id是整数
-            chat_id = int(source_chat_id)
-            
-            # 先尝试获取频道/群组信息
-            try:
-                entity = await self.client.get_entity(chat_id)
-                entity_type = "频道" if hasattr(entity, 'broadcast') and entity.broadcast else "群组"
-                entity_name = entity.title if hasattr(entity, 'title') else str(entity)
-                logger.info(f"成功获取{entity_type}信息: {entity_name}")
-            except Exception as entity_error:
-                logger.error(f"无法获取频道/群组 {chat_id} 的信息: {entity_error}")
-                logger.error("可能的原因:")
-                logger.error("1. 频道/群组ID不正确")
-                logger.error("2. 你的账号没有访问该频道/群组的权限")
-                logger.error("3. 频道/群组不存在或已被删除")
-                logger.error("4. 私有频道需要先加入或获得访问权限")
+            while remaining:
+                source_chat_id, item = await queue.get()
+                source_stats = stats[source_chat_id]
+                forward_batch = forward_batches[source_chat_id] if forward_mode else None
                 
-                # 尝试其他方法获取实体
-                logger.info("尝试其他方法获取频道信息...")
-                try:
-                    # 尝试通过对话列表查找
-                    async for dialog in self.client.iter_dialogs():
-                        if dialog.id == chat_id:
-                            logger.info(f"在对话列表中找到: {dialog.name}")
-                            entity = dialog.entity
-                            break
-                    else:
-                        logger.error("在对话列表中也未找到该频道")
-                        return
-                except Exception as dialog_error:
-                    logger.error(f"通过对话列表查找也失败: {dialog_error}")
-                    return
-            
-            # 计算时间范围
-            offset_date = None
-            if days_back:
-                offset_date = datetime.now() - timedelta(days=days_back)
-            
-            # 获取历史消息
-            messages = []
-            async for message in self.client.iter_messages(
-                chat_id,
-                limit=limit,
-                offset_date=offset_date,
-                reverse=True  # 按时间顺序同步，确保被回复的消息先处理
-            ):
-                messages.append(message)
-            
-            # 确保消息按时间顺序排列（最旧的在前）
-            messages.sort(key=lambda x: x.date)
-            
-            logger.info(f"找到 {len(messages)} 条历史消息")
-            
-            # 同步消息
-            synced_count = 0
-            for i, message in enumerate(messages):
-                # 添加调试信息 - 检测所有文件类型（安全访问）
-                msg_types = []
+                if item is None:
+                    # 该源抓取结束
+                    remaining -= 1
+                    if forward_batch:
+                        source_stats[1] += await self.forward_batch(source_chat_id, forward_batch)
+                    source_name = self.config['source_chats'].get(source_chat_id, str(source_chat_id))
+                    logger.info(f"历史消息同步完成: {source_name} - 共同步 {source_stats[1]}/{source_stats[0]} 条消息")
+                    continue
                 
-                # 检查消息类型
-                if hasattr(message, '__class__') and 'MessageService' in str(message.__class__):
-                    msg_types.append("系统消息")
-                elif getattr(message, 'text', None):
-                    msg_types.append("文本")
+                i = source_stats[0]
+                if isinstance(item, list):
+                    source_stats[1] += await self.sync_history_album(item, i, source_chat_id, forward_batch)
+                    source_stats[0] += len(item)
+                else:
+                    source_stats[1] += await self.sync_history_message(item, i, source_chat_id, forward_batch)
+                    source_stats[0] += 1
                 
-                # 检查文件类型
-                if getattr(message, 'document', None):
-                    mime_type = getattr(message.document, 'mime_type', 'unknown')
-                    try:
-                        file_name = 'unnamed'
-                        if hasattr(message.document, 'attributes') and message.document.attributes:
-                            for attr in message.document.attributes:
-                                if hasattr(attr, 'file_name') and attr.file_name:
-                                    file_name = attr.file_name
-                                    break
-                        msg_types.append(f"文档({mime_type}:{file_name})")
-                    except:
-                        msg_types.append(f"文档({mime_type})")
-                        
-                if getattr(message, 'photo', None):
-                    msg_types.append("图片")
-                if getattr(message, 'video', None):
-                    msg_types.append("视频")
-                if getattr(message, 'audio', None):
-                    msg_types.append("音频")
-                if getattr(message, 'voice', None):
-                    msg_types.append("语音")
-                if getattr(message, 'video_note', None):
-                    msg_types.append("视频消息")
-                if getattr(message, 'sticker', None):
-                    msg_types.append("贴纸")
-                if getattr(message, 'animation', None):
-                    msg_types.append("动画/GIF")
-                if getattr(message, 'media', None):
-                    # 检查是否已经识别了其他媒体类型
-                    known_media = any([
-                        getattr(message, 'document', None),
-                        getattr(message, 'photo', None),
-                        getattr(message, 'video', None),
-                        getattr(message, 'audio', None),
-                        getattr(message, 'voice', None),
-                        getattr(message, 'video_note', None),
-                        getattr(message, 'sticker', None),
-                        getattr(message, 'animation', None)
-                    ])
-                    if not known_media:
-                        msg_types.append(f"其他媒体({type(message.media).__name__})")
+                # 显示进度
+                processed_before = processed
+                processed += source_stats[0] - i
+                if processed // 100 != processed_before // 100:
+                    synced_total = sum(synced for _, synced in stats.values())
+                    logger.info(f"已处理 {processed} 条消息，已同步 {synced_total} 条")
+        finally:
+            for task in fetch_tasks:
+                if not task.done():
+                    task.cancel()
+            self.checkpoints.flush()
+            self.history_queue = None
+            logger.info(f"同步统计: {self.metrics.summary()}")
+    
+    async def resolve_source_entity(self, chat_id):
+        """获取频道/群组信息，失败时返回None"""
+        try:
+            entity = await self.client.get_entity(self.input_peers.get(chat_id, chat_id))
+            entity_type = "频道" if hasattr(entity, 'broadcast') and entity.broadcast else "群组"
+            entity_name = entity.title if hasattr(entity, 'title') else str(entity)
+            logger.info(f"成功获取{entity_type}信息: {entity_name}")
+            return entity
+        except Exception as entity_error:
+            logger.error(f"无法获取频道/群组 {chat_id} 的信息: {entity_error}")
+            logger.error("可能的原因:")
+            logger.error("1. 频道/群组ID不正确")
+            logger.error("2. 你的账号没有访问该频道/群组的权限")
+            logger.error("3. 频道/群组不存在或已被删除")
+            logger.error("4. 私有频道需要先加入或获得访问权限")
+            
+            # 尝试其他方法获取实体
+            logger.info("尝试其他方法获取频道信息...")
+            try:
+                # 尝试通过对话列表查找，顺便缓存遇到的其他源和目标频道，避免重复遍历
+                wanted = set(self.config['source_chats'])
+                wanted.update(self.route_table.targets())
+                async for dialog in self.client.iter_dialogs():
+                    if dialog.id in wanted:
+                        self.entity_cache.put(dialog.id, utils.get_input_peer(dialog.entity))
+                    if dialog.id == chat_id:
+                        logger.info(f"在对话列表中找到: {dialog.name}")
+                        return dialog.entity
+                logger.error("在对话列表中也未找到该频道")
+            except Exception as dialog_error:
+                logger.error(f"通过对话列表查找也失败: {dialog_error}")
+            return None
+    
+    async def get_input_peer(self, chat):
+        """获取聊天的InputPeer，无法解析时返回None
+
+        依次查找内存、本地实体缓存、Telethon会话，最后才遍历对话列表；解析结果写入本地缓存。
+        """
+        peer = self.input_peers.get(chat)
+        if peer is not None:
+            return peer
+        peer = self.entity_cache.get(chat)
+        if peer is None:
+            try:
+                peer = await self.client.get_input_entity(chat)
+            except Exception:
+                entity = await self.resolve_source_entity(chat)
+                if entity is None:
+                    return None
+                peer = utils.get_input_peer(entity)
+            self.entity_cache.put(chat, peer)
+        self.input_peers[chat] = peer
+        return peer
+    
+    async def refresh_peers(self, *chats):
+        """丢弃聊天的缓存实体并重新解析，全部解析成功时返回True"""
+        resolved = True
+        for chat in chats:
+            if chat is None:
+                continue
+            self.input_peers.pop(chat, None)
+            self.entity_cache.delete(chat)
+            if await self.get_input_peer(chat) is None:
+                resolved = False
+        return resolved
+    
+    async def resolve_target_peers(self):
+        """预先为主账号和所有发送账号解析目标频道，之后的发送直接使用缓存的InputPeer"""
+        for target_id in self.route_table.targets():
+            if await self.get_input_peer(target_id) is None:
+                logger.error(f"无法解析目标频道 {target_id}，发送时将由Telethon重新解析")
+            for sender in self.sender_pool.helpers():
+                await self.get_sender_peer(sender, target_id)
+    
+    async def resolve_source_peers(self):
+        """解析所有源，返回可以订阅的InputPeer列表"""
+        peers = []
+        for chat_id, name in self.config['source_chats'].items():
+            peer = await self.get_input_peer(chat_id)
+            if peer is None:
+                logger.error(f"无法解析源 {name} ({chat_id})，将收不到它的新消息")
+            else:
+                peers.append(peer)
+        return peers
+    
+    async def fetch_history(self, source_chat_id, queue, semaphore, limit, offset_date):
+        """抓取阶段: 按时间顺序把一个源的历史消息放入队列，结束时放入 (源ID, None)
+
+        连续的同一相册消息合并成列表放入队列，其他消息逐条放入。
+        """
+        source_name = self.config['source_chats'].get(source_chat_id, str(source_chat_id))
+        try:
+            async with semaphore:
+                logger.info(f"开始同步 {source_name} 的历史消息...")
+                logger.info(f"源ID: {source_chat_id} (类型: {type(source_chat_id)})")
                 
-                msg_type = "+".join(msg_types) if msg_types else "空消息"
+                # 确保chat_id是整数
+                chat_id = int(source_chat_id)
                 
-                if message.reply_to:
-                    reply_id = message.reply_to.reply_to_msg_id if hasattr(message.reply_to, 'reply_to_msg_id') else "unknown"
-                    logger.info(f"处理消息 {i+1}: {msg_type} 回复消息 (回复ID: {reply_id})")
-                    logger.info(f"当前消息ID: {message.id}")
-                    logger.info(f"映射表中是否有回复目标: {reply_id in self.message_mapping}")
-                else:
-                    logger.info(f"处理消息 {i+1}: {msg_type} 普通消息 (ID: {message.id})")
+                # 先解析频道/群组
+                peer = await self.get_input_peer(chat_id)
+                if peer is None:
+                    await queue.put((source_chat_id, None))
+                    return
                 
-                # 检查是否应该同步这条消息
-                should_sync = self.should_sync_message(message)
-                logger.info(f"消息 {i+1} 是否应该同步: {should_sync}")
+                # 从断点继续，跳过已经处理过的消息
+                min_id = 0
+                if self.config.get('history_sync', {}).get('resume', True):
+                    min_id = self.checkpoints.get(source_chat_id)
+                    if min_id:
+                        logger.info(f"{source_name} 从断点继续: 跳过ID不大于 {min_id} 的消息")
                 
-                if should_sync:
-                    success = await self.sync_single_message(
-                        message, 
-                        source_chat_id, 
-                        target_channel,
-                        add_timestamp=True
-                    )
-                    
-                    if success:
-                        synced_count += 1
-                        logger.info(f"✅ 消息 {i+1} 同步成功")
+                album = []
+                # 从最旧的开始返回，确保被回复的消息先处理
+                async for message in self.iter_history(peer, limit, offset_date, min_id):
+                    if self.recorder and self.config.get('record', {}).get('history', True):
+                        self.recorder.record('history', source_chat_id, message)
+                    grouped_id = getattr(message, 'grouped_id', None)
+                    if album and (grouped_id != album[0].grouped_id or len(album) >= MAX_ALBUM_SIZE):
+                        await queue.put((source_chat_id, album))
+                        album = []
+                    if grouped_id:
+                        album.append(message)
                     else:
-                        logger.warning(f"❌ 消息 {i+1} 同步失败")
-                else:
-                    logger.info(f"⏭️ 消息 {i+1} 被过滤，跳过同步")
-                
-                # 显示进度
-                if (i + 1) % 10 == 0:
-                    logger.info(f"已处理 {i + 1}/{len(messages)} 条消息，已同步 {synced_count} 条")
-                
-                # 避免API限制
-                await asyncio.sleep(0.5)
-            
-            logger.info(f"历史消息同步完成: {source_name} - 共同步 {synced_count}/{len(messages)} 条消息")
-            
+                        await queue.put((source_chat_id, message))
+                if album:
+                    await queue.put((source_chat_id, album))
         except Exception as e:
             logger.error(f"同步历史消息时出错: {e}")
             logger.error(f"群组: {source_name} (ID: {source_chat_id})")
+        # 通知发送阶段该源已结束
+        await queue.put((source_chat_id, None))
+    
+    async def sync_history_message(self, message, i, source_chat_id, forward_batch=None):
+        """发送阶段: 处理一条历史消息，返回本次同步的条数
+
+        传入 forward_batch 时为原生转发模式，消息先进入批次，批次满时一起转发。
+        """
+        success = False
+        info = classify(message)
+        
+        # 逐条的详细信息只在DEBUG级别输出，避免无人查看时也格式化
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            if info.reply_to:
+                logger.debug(
+                    "处理消息 %d: %s 回复消息 (ID: %s, 回复ID: %s)",
+                    i + 1, info.describe(), message.id, info.reply_to
+                )
+            else:
+                logger.debug("处理消息 %d: %s 普通消息 (ID: %s)", i + 1, info.describe(), message.id)
+        
+        # 检查是否应该同步这条消息
+        should_sync = self.should_sync_message(message, source_chat_id, info)
+        
+        if should_sync and forward_batch is not None:
+            forward_batch.append(message)
+            if len(forward_batch) < min(self.config.get('forward_batch_size', 100), 100):
+                return 0
+            return await self.forward_batch(source_chat_id, forward_batch)
+        elif should_sync:
+            try:
+                # 断点可能停在之前推迟的消息处，重新同步时跳过已经发送过的目标
+                success = await self.deliver([message], source_chat_id, info, add_timestamp=True, skip_synced=True) > 0
+            except FloodWaitError as e:
+                # 断点不会越过这条消息，下次历史同步或补齐时重新发送
+                self.defer(source_chat_id, [message], e)
+                return 0
+            
+            if success:
+                logger.debug("✅ 消息 %d 同步成功", i + 1)
+            else:
+                logger.debug("❌ 消息 %d 同步失败", i + 1)
+        else:
+            logger.debug("⏭️ 消息 %d 被过滤，跳过同步", i + 1)
+            if forward_batch:
+                # 断点要等批次中的消息转发后才能推进
+                return 0
+        
+        # 记录断点，重启后从这里继续 (之前推迟的消息这次处理完后取消登记)
+        self.checkpoints.complete(source_chat_id, [message.id])
+        
+        return 1 if success else 0
+    
+    async def sync_history_album(self, messages, i, source_chat_id, forward_batch=None):
+        """发送阶段: 处理一个历史相册，返回本次同步的条数"""
+        logger.debug(
+            "处理消息 %d-%d: 相册 (%d 个文件, ID: %s-%s)",
+            i + 1, i + len(messages), len(messages), messages[0].id, messages[-1].id
+        )
+        
+        if forward_batch is not None:
+            # 同一相册必须在同一次转发请求中，才能保持相册样式
+            synced = 0
+            batch_size = min(self.config.get('forward_batch_size', 100), 100)
+            if len(forward_batch) + len(messages) > batch_size:
+                synced += await self.forward_batch(source_chat_id, forward_batch)
+            lead = next((m for m in messages if getattr(m, 'text', None)), messages[0])
+            if self.should_sync_message(lead, source_chat_id):
+                forward_batch.extend(messages)
+                if len(forward_batch) >= batch_size:
+                    synced += await self.forward_batch(source_chat_id, forward_batch)
+            elif not forward_batch:
+                self.checkpoints.advance(source_chat_id, messages[-1].id)
+            return synced
+        
+        try:
+            synced = await self.deliver(messages, source_chat_id, add_timestamp=True, skip_synced=True)
+        except FloodWaitError as e:
+            self.defer(source_chat_id, messages, e)
+            return 0
+        if synced:
+            logger.debug("✅ 相册同步成功: %d/%d 个文件", synced, len(messages))
+        else:
+            logger.debug("⏭️ 相册未同步")
+        
+        # 记录断点，重启后从这里继续
+        self.checkpoints.complete(source_chat_id, [m.id for m in messages])
+        return synced
     
     async def sync_all_history(self):
         """同步所有源的历史消息"""
@@ -433,31 +1514,226 @@ class TelegramSyncer:
         
         logger.info(f"开始同步所有源的历史消息 (限制: {limit} 条, 时间范围: {days_back} 天)")
         
-        for source_chat_id in self.config['source_chats']:
-            await self.sync_history(source_chat_id, limit, days_back)
-            # 源之间的延迟
-            await asyncio.sleep(2)
+        await self.sync_history_sources(list(self.config['source_chats']), limit, days_back)
+    
+    def register_handlers(self, source_peers):
+        """注册消息处理器，只订阅配置的源，其他对话的消息在Telethon层直接丢弃
+
+        重新注册时先移除之前的处理器；移除和注册之间没有await，不会漏掉任何更新。
+        """
+        for callback, event in self.event_handlers:
+            self.client.remove_event_handler(callback, event)
+        self.event_handlers = []
+        
+        async def handler(event):
+            await self.sync_message(event)
+        self.event_handlers.append((handler, events.NewMessage(chats=source_peers)))
+        
+        # 编辑和删除通过消息映射找到目标中的对应消息
+        propagate_config = self.config.get('propagate', {})
+        if propagate_config.get('edits', True):
+            async def edit_handler(event):
+                self.sync_edit(event)
+            self.event_handlers.append((edit_handler, events.MessageEdited(chats=source_peers)))
+        if propagate_config.get('deletes', False):
+            async def delete_handler(event):
+                self.sync_delete(event)
+            self.event_handlers.append((delete_handler, events.MessageDeleted(chats=source_peers)))
+        
+        for callback, event in self.event_handlers:
+            self.client.add_event_handler(callback, event)
+    
+    def start_background(self, coro):
+        """在后台运行任务，退出时统一取消"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+    
+    def schedule_reload(self):
+        """收到SIGHUP时在后台重新加载配置"""
+        logger.info("收到重新加载配置的信号")
+        self.start_background(self.reload_config())
+    
+    async def watch_config(self, interval):
+        """定期检查配置文件的修改时间，变化时重新加载"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.stat(self.config_file).st_mtime_ns
+            except OSError:
+                continue
+            if mtime != self.config_mtime:
+                logger.info("检测到配置文件已修改")
+                await self.reload_config()
+    
+    async def reload_config(self):
+        """重新加载配置文件，不重启客户端，成功时返回True
+
+        过滤规则、路由、来源信息等设置立即生效；新加入的源和目标先解析完成，
+        然后一次性替换配置并重新注册处理器，实时转发不中断。新加入的源先暂存实时消息，
+        按 history_sync 同步历史 (如果启用) 并补齐缺口后再放行。
+        账号、状态存储、限速等需要重启才能生效的配置项保持原值。
+        """
+        async with self.reload_lock:
+            loaded = self.read_config(self.config_file)
+            if loaded is None:
+                logger.error("重新加载配置失败，继续使用当前配置")
+                return False
+            config, filter_engine, route_table = loaded
+            
+            for key in RESTART_KEYS:
+                if config.get(key) != self.config.get(key):
+                    logger.warning(f"配置项 {key} 的修改需要重启后才能生效")
+                    if key in self.config:
+                        config[key] = self.config[key]
+                    else:
+                        config.pop(key, None)
+            
+            old_sources = set(self.config['source_chats'])
+            added = [chat_id for chat_id in config['source_chats'] if chat_id not in old_sources]
+            removed = [chat_id for chat_id in old_sources if chat_id not in config['source_chats']]
+            
+            # 先解析新的源和目标，替换配置前完成所有需要等待的请求
+            source_peers = []
+            for chat_id, name in config['source_chats'].items():
+                peer = await self.get_input_peer(chat_id)
+                if peer is None:
+                    logger.error(f"无法解析源 {name} ({chat_id})，将收不到它的新消息")
+                else:
+                    source_peers.append(peer)
+            for target_id in route_table.targets():
+                if target_id not in self.input_peers and await self.get_input_peer(target_id) is None:
+                    logger.error(f"无法解析目标频道 {target_id}，发送时将由Telethon重新解析")
+                for sender in self.sender_pool.helpers():
+                    await self.get_sender_peer(sender, target_id)
+            
+            # 以下替换过程中没有await，处理中的消息要么使用旧配置，要么使用新配置
+            dedup_changed = config.get('dedup') != self.config.get('dedup')
+            held = self.hold_live_messages(added)
+            self.config, self.filter_engine, self.route_table = config, filter_engine, route_table
+            if dedup_changed:
+                dedup_config = dict(config.get('dedup', {}))
+                self.dedup_index = DuplicateIndex(**dedup_config) if dedup_config.pop('enabled', False) else None
+            self.album_collector.window = config.get('album_window', 0.5)
+            propagate_config = config.get('propagate', {})
+            self.edit_coalescer.delay = propagate_config.get('edit_delay', 2)
+            self.delete_batcher.delay = propagate_config.get('delete_delay', 1)
+            if self.event_handlers:
+                self.register_handlers(source_peers)
+            
+            logger.info(
+                f"配置已重新加载: 新增源 {[config['source_chats'][chat_id] for chat_id in added]}，"
+                f"移除源 {removed}，目标频道 {route_table.targets()}"
+            )
+            if held:
+                self.start_background(self.start_new_sources(held))
+            return True
+    
+    async def start_new_sources(self, source_chat_ids):
+        """新加入的源: 按 history_sync 同步从未同步过的源的历史，再补齐缺口并放行暂存的实时消息"""
+        try:
+            history_config = self.config.get('history_sync', {})
+            fresh = [chat_id for chat_id in source_chat_ids if not self.checkpoints.get(chat_id)]
+            if fresh and history_config.get('enabled', False):
+                await self.sync_history_sources(fresh, history_config.get('limit', 100), history_config.get('days_back', 7))
+        except Exception as e:
+            logger.error(f"新源的历史同步失败: {e}")
+        finally:
+            await self.catch_up_sources(source_chat_ids)
     
     async def start_sync(self, sync_history_first=True):
         """开始监听和同步消息"""
         if not self.client:
             await self.initialize_client()
         
-        # 首先同步历史消息
-        if sync_history_first:
-            await self.sync_all_history()
+        # 定期输出汇总统计，代替逐条消息的日志
+        summary_task = None
+        summary_interval = self.config.get('metrics', {}).get('summary_interval', 60)
+        if summary_interval:
+            summary_task = asyncio.create_task(self.metrics.run_summary(summary_interval))
         
-        # 注册消息处理器
-        @self.client.on(events.NewMessage)
-        async def handler(event):
-            await self.sync_message(event)
+        # 断点、本地归档和搜索索引在没有新消息时也定期提交缓冲的记录
+        self.start_background(self.checkpoints.run_flush())
+        if self.archive is not None:
+            self.start_background(self.archive.run_flush())
+        if self.search_index is not None:
+            self.start_background(self.search_index.run_flush())
         
-        logger.info("开始监听新消息...")
-        logger.info(f"监听的源: {list(self.config['source_chats'].values())}")
-        logger.info(f"目标频道: {self.config['target_channel']}")
+        # 可选的指标和健康检查HTTP服务
+        metrics_server = None
+        metrics_config = self.config.get('metrics', {})
+        if metrics_config.get('http_port'):
+            metrics_server = MetricsServer(
+                self.metrics,
+                metrics_config.get('http_host', '127.0.0.1'),
+                metrics_config['http_port'],
+                health=self.health
+            )
+            await metrics_server.start()
         
-        # 保持运行
-        await self.client.run_until_disconnected()
+        watch_task = None
+        sighup_registered = False
+        self.send_queue.start()
+        try:
+            await self.resolve_target_peers()
+            
+            # 首先同步历史消息
+            if sync_history_first:
+                await self.sync_all_history()
+            
+            # 注册消息处理器，只订阅配置的源，其他对话的消息在Telethon层直接丢弃
+            source_peers = await self.resolve_source_peers()
+            if not source_peers:
+                logger.warning("没有可以监听的源，不会收到任何新消息")
+            
+            # 注册处理器前先暂存各源的实时消息，补齐停机期间的缺口后再按顺序放行
+            catch_up_config = self.config.get('catch_up', {})
+            catch_up_enabled = catch_up_config.get('enabled', True)
+            held = self.hold_live_messages(list(self.config['source_chats'])) if catch_up_enabled else []
+            
+            self.register_handlers(source_peers)
+            
+            if catch_up_enabled:
+                await self.catch_up_sources(held)
+                watch_task = asyncio.create_task(self.watch_connection(catch_up_config.get('check_interval', 5)))
+            
+            # 修改配置后发送SIGHUP，或开启 config_reload.watch 自动检测，无需重启即可生效
+            reload_config = self.config.get('config_reload', {})
+            if reload_config.get('watch', False):
+                self.start_background(self.watch_config(reload_config.get('interval', 5)))
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self.schedule_reload)
+                sighup_registered = True
+            except (AttributeError, NotImplementedError, RuntimeError):
+                # Windows不支持SIGHUP
+                pass
+            
+            logger.info("开始监听新消息...")
+            logger.info(f"监听的源: {list(self.config['source_chats'].values())}")
+            logger.info(f"目标频道: {self.route_table.targets()}")
+            
+            # 保持运行
+            await self.client.run_until_disconnected()
+        finally:
+            if summary_task:
+                summary_task.cancel()
+            if watch_task:
+                watch_task.cancel()
+            if sighup_registered:
+                asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+            for task in list(self.background_tasks):
+                task.cancel()
+            await asyncio.gather(*self.background_tasks, return_exceptions=True)
+            if metrics_server:
+                await metrics_server.close()
+            await self.album_collector.flush_all()
+            await self.send_queue.join()
+            await self.edit_coalescer.flush_all()
+            await self.delete_batcher.flush_all()
+            await self.send_queue.close()
+            await self.sender_pool.disconnect()
+            self.close()
 
 async def main():
     syncer = TelegramSyncer()